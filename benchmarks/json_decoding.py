@@ -0,0 +1,82 @@
+"""
+Measures the parse throughput of every installed json backend (see
+`common/json_codec.py`) on NQ dataset files.
+
+Usage (from the repository root):
+    python -m benchmarks.json_decoding --files ./qa_data/30_total_documents/*.jsonl
+"""
+from common.configs.log_config import configure_log
+import common.json_codec as json_codec
+import tests.consts as test_consts
+
+from argparse import ArgumentParser, Namespace
+from typing import List, Dict
+import logging
+import time
+
+
+def benchmark_file(
+    file_path: str,
+    num_repeats: int
+) -> Dict[str, Dict[str, float]]:
+    """
+    Decodes all `file_path` lines with every backend (best of
+    `num_repeats` runs) and returns the throughput of each backend.
+    """
+    with open(file_path, "rb") as f:
+        lines = f.readlines()
+    num_bytes = sum(len(line) for line in lines)
+
+    results = {}
+    for backend in json_codec.get_backends():
+        best_time = float("inf")
+        for _ in range(num_repeats):
+            start_time = time.perf_counter()
+            for line in lines:
+                json_codec.loads(line, backend=backend)
+            best_time = min(best_time, time.perf_counter() - start_time)
+
+        results[backend] = {
+            "seconds": best_time,
+            "mb_per_sec": num_bytes / best_time / 2**20,
+            "lines_per_sec": len(lines) / best_time
+        }
+    return results
+
+
+def _read_args() -> Namespace:
+    parser = ArgumentParser("")
+    parser.add_argument(
+        "--files",
+        help="NQ dataset (.jsonl) files to parse.",
+        type=str,
+        nargs="+",
+        default=[test_consts.TEST_DOCUMENT_PATH]
+    )
+    parser.add_argument(
+        "--num_repeats",
+        help="number of times to parse each file (best run is reported).",
+        type=int,
+        default=3
+    )
+    return parser.parse_args()
+
+
+def _log_results(file_path: str, results: Dict[str, Dict[str, float]]) -> None:
+    baseline = results["json"]["seconds"]
+    lines: List[str] = [f"Parse throughput [{file_path}]:"]
+    for backend, result in results.items():
+        lines.append(
+            f"  {backend:<8} {result['mb_per_sec']:>8.1f} MB/s " +
+            f"{result['lines_per_sec']:>10.0f} lines/s " +
+            f"(x{baseline / result['seconds']:.2f} vs json)"
+        )
+    logging.info("\n".join(lines))
+
+
+if __name__ == "__main__":
+    configure_log()
+    args = _read_args()
+    logging.info(f"Installed json backends: {json_codec.get_backends()}")
+    for file_path in args.files:
+        _log_results(file_path, benchmark_file(file_path, args.num_repeats))
@@ -2,6 +2,7 @@ RESULTS_DIR = "./results"
 DATA_SRC_DIR = "./lost-in-the-middle/qa_data"
 DATA_DST_DIR = "./qa_data"
 EXPERIMENT_DATA_FOLDER = "./qa_data/{num_docs}_total_documents"
+TOKEN_LENGTHS_DIR = "./qa_data/token_lengths"
 
 SUPPORTED_NUM_DOCS = [10, 20, 30]
 SUPPORTED_GOLD_IDXS = [0, 4, 9, 14, 19, 24, 29]
@@ -14,4 +15,8 @@ DEFAULT_MAX_TOKENS = 128
 DEFAULT_NUM_GPUS = 1
 DEFAULT_TEMPERATURE = 0.1
 DEFAULT_TOP_P = 0.9
-TEST_NUM_EXAMPLES = 3
\ No newline at end of file
+TEST_NUM_EXAMPLES = 3
+DEFAULT_NUM_WORKERS = 1
+DEFAULT_TOKEN_COUNT_CACHE_SIZE = 1_000_000
+DEFAULT_GENERATION_CACHE_SIZE = 1_000_000
+DEFAULT_GENERATION_CACHE_MAX_AGE_DAYS = 30
@@ -1,6 +1,9 @@
 from pydantic.dataclasses import dataclass
-from typing import TypeVar, Optional, Type, Dict, Any
-from copy import deepcopy
+from typing import (
+    TypeVar, NamedTuple, Optional, Type, Iterable, List, Dict, Any
+)
+from dataclasses import fields, MISSING
+from array import array
 from enum import StrEnum
 
 
@@ -22,7 +25,7 @@ class PromptingMode(StrEnum):
 # Original source: https://github.com/nelson-liu/lost-in-the-middle
 # Licensed under the MIT License
 # Modifications may have been made to suit specific project needs.
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Document:
     title: str
     text: str
@@ -33,17 +36,92 @@ class Document:
     original_retrieval_index: Optional[int] = None
 
     @classmethod
-    def from_dict(cls: Type[T], data: dict) -> T:
-        data = deepcopy(data)
+    def from_dict(
+        cls: Type[T],
+        data: dict,
+        validate: Optional[bool] = True
+    ) -> T:
+        """
+        Creates a Document from `data` without copying or modifying it.
+
+        If `validate` is False, the pydantic validation is skipped and the
+        fields are set as is (besides the `score` float conversion) - meant
+        for trusted input such as the decoded NQ dataset json lines.
+        """
         if not data:
             raise ValueError("Must provide data for creation of Document from dict.")
-        id = data.pop("id", None)
-        score = data.pop("score", None)
+        score = data.get("score")
         # Convert score to float if it's provided.
         if score is not None:
             score = float(score)
-        return cls(**dict(data, id=id, score=score))
+
+        if validate is True:
+            return cls(**dict(data, score=score))
+
+        document = object.__new__(cls)
+        for field, default in _DOCUMENT_FIELDS:
+            object.__setattr__(document, field, data.get(field, default))
+        object.__setattr__(document, "score", score)
+        return document
 
     def to_dict(self) -> Dict[str, Any]:
         field_names = list(self.__annotations__.keys())
         return {field: getattr(self, field) for field in field_names}
+
+
+_DOCUMENT_FIELDS = tuple(
+    (field.name, field.default if field.default is not MISSING else None)
+    for field in fields(Document)
+)
+
+
+class DocumentTable:
+    """
+    Stores every distinct `Document` once, so documents lists that share
+    passages (e.g. the same distractors of a question across the different
+    gold index files) can be kept as compact index arrays into the table.
+
+    Documents are keyed by their full value rather than by `id` alone - the
+    same passage can be retrieved for different questions with a different
+    `score` and `original_retrieval_index`, and gold documents have no `id`.
+    """
+
+    def __init__(self) -> None:
+        self._documents: List[Document] = []
+        self._indices: Dict[Document, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __getitem__(self, idx: int) -> Document:
+        return self._documents[idx]
+
+    def intern(self, documents: Iterable[Document]) -> array:
+        """
+        Adds the new `documents` to the table and returns the indices of all
+        `documents` in the table.
+        """
+        indices = array("i")
+        for document in documents:
+            idx = self._indices.get(document)
+            if idx is None:
+                idx = len(self._documents)
+                self._indices[document] = idx
+                self._documents.append(document)
+            indices.append(idx)
+        return indices
+
+    def resolve(self, indices: Iterable[int]) -> List[Document]:
+        return [self._documents[idx] for idx in indices]
+
+
+class TokenizedPrompt(NamedTuple):
+    """
+    A prompt together with its token ids, so it's tokenized only once -
+    the ids are passed to the llm as is and `num_tokens` is the prompt
+    length without the special tokens added by the tokenizer (as counted
+    by `HfTokenizer.count_tokens`).
+    """
+    text: str
+    token_ids: List[int]
+    num_tokens: int
@@ -119,6 +119,175 @@ def read_cli_env_args() -> Namespace:
         default=consts.DEFAULT_MAX_GPU_UTIL
     )
 
+    parser.add_argument(
+        "--stream_window",
+        help="number of examples to prompt and generate at a time. when " +
+            "set, data files are read lazily instead of being fully loaded.",
+        type=int
+    )
+
+    parser.add_argument(
+        "--num_workers",
+        help="number of workers to use while extracting and parsing " +
+            "the data files.",
+        type=int,
+        default=consts.DEFAULT_NUM_WORKERS
+    )
+
+    parser.add_argument(
+        "--read_compressed",
+        help="boolean that indicates the data should be read directly " +
+            "from the compressed .jsonl.gz files, without extracting them.",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--seed",
+        help="seed to use when shuffling the openbook_random documents.",
+        type=int
+    )
+
+    parser.add_argument(
+        "--data_cache_dir",
+        help="directory to cache the parsed data files in (disabled if not set).",
+        type=str
+    )
+
+    parser.add_argument(
+        "--intern_documents",
+        help="boolean that indicates each distinct document should be " +
+            "stored once and shared by all the experiment data files.",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--max_examples",
+        help="maximum number of examples to read from each data file " +
+            "(all examples are read if not set).",
+        type=int
+    )
+
+    parser.add_argument(
+        "--verify_token_lengths",
+        help="boolean that indicates the prompts token counts should be " +
+            "derived from a per-document token length index as well, and " +
+            "compared with their full tokenization.",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--token_count_cache",
+        help="path of an sqlite file to cache the prompts token ids and " +
+            "token counts in across runs, so re-runs don't tokenize them " +
+            "again (disabled if not set).",
+        type=str
+    )
+
+    parser.add_argument(
+        "--token_budget",
+        help="maximum number of prompt tokens - the lowest score non-gold " +
+            "documents are dropped from longer prompts (disabled if not set).",
+        type=int
+    )
+
+    parser.add_argument(
+        "--enable_prefix_caching",
+        help="boolean that indicates vLLM should cache and reuse the " +
+            "prompts shared prefixes.",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--prefix_scheduling",
+        help="boolean that indicates the prompts of all data files should " +
+            "be generated together, ordered by their shared prefixes.",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--async_engine",
+        help="boolean that indicates the vLLM async engine should be used, " +
+            "so predictions are scored as soon as they are generated.",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--flush_results",
+        help="boolean that indicates the results of each window should be " +
+            "appended to disk, instead of being kept in memory until the " +
+            "experiment ends. only the results are flushed - set " +
+            "--stream_window as well, so the data isn't fully loaded.",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--log_progress",
+        help="boolean that indicates the results of each window should be " +
+            "logged (and synced) to disk, so an interrupted run can be " +
+            "resumed with --resume.",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--resume",
+        help="boolean that indicates an interrupted run with the same " +
+            "arguments should be resumed - only its missing examples are " +
+            "generated (the interrupted run must have set --log_progress).",
+        type=bool,
+        default=False
+    )
+
+    parser.add_argument(
+        "--generation_cache",
+        help="path of an sqlite file to cache the model completions in " +
+            "across runs (disabled if not set).",
+        type=str
+    )
+
+    # a sweep runs an experiment for each config of the grid of these
+    # args, and loads the model once for all of them
+    parser.add_argument(
+        "--sweep_experiments",
+        help="experiment types to sweep over (--experiment if not set).",
+        type=str,
+        nargs="+",
+        choices=[et.value for et in ExperimentType]
+    )
+
+    parser.add_argument(
+        "--sweep_prompting_modes",
+        help="prompting types to sweep over (--prompting_mode if not set).",
+        type=str,
+        nargs="+",
+        choices=[pm.value for pm in PromptingMode]
+    )
+
+    parser.add_argument(
+        "--sweep_num_docs",
+        help="numbers of documents to sweep over in gold_idx_change " +
+            "experiments (--num_docs if not set).",
+        type=int,
+        nargs="+",
+        choices=consts.SUPPORTED_NUM_DOCS
+    )
+
+    parser.add_argument(
+        "--sweep_gold_idxs",
+        help="gold answer indices to sweep over in num_docs_change " +
+            "experiments (--gold_idx if not set).",
+        type=int,
+        nargs="+",
+        choices=consts.SUPPORTED_GOLD_IDXS
+    )
+
     args = parser.parse_args()
     logging.info(
         "Environment Variables:\n" +
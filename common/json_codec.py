@@ -0,0 +1,118 @@
+from typing import List, Dict, Union, Optional, Callable, Any
+import json
+
+# optional faster json backends, ordered by preference
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _orjson_dumps(
+    obj: Any,
+    indent: Optional[int] = None,
+    default: Optional[Callable[[Any], Any]] = None
+) -> str:
+    if indent not in (None, 2):
+        # orjson supports only 2 spaces indentation
+        return _json_dumps(obj, indent, default)
+    option = orjson.OPT_INDENT_2 if indent == 2 else None
+    return orjson.dumps(obj, default=default, option=option).decode("utf-8")
+
+
+def _msgspec_dumps(
+    obj: Any,
+    indent: Optional[int] = None,
+    default: Optional[Callable[[Any], Any]] = None
+) -> str:
+    encoded = msgspec.json.encode(obj, enc_hook=default)
+    if indent is not None:
+        encoded = msgspec.json.format(encoded, indent=indent)
+    return encoded.decode("utf-8")
+
+
+def _json_dumps(
+    obj: Any,
+    indent: Optional[int] = None,
+    default: Optional[Callable[[Any], Any]] = None
+) -> str:
+    return json.dumps(obj, indent=indent, default=default)
+
+
+_DECODERS: Dict[str, Callable[[Union[str, bytes]], Any]] = {}
+_ENCODERS: Dict[str, Callable[..., str]] = {}
+
+if orjson is not None:
+    _DECODERS["orjson"] = orjson.loads
+    _ENCODERS["orjson"] = _orjson_dumps
+if msgspec is not None:
+    _DECODERS["msgspec"] = msgspec.json.decode
+    _ENCODERS["msgspec"] = _msgspec_dumps
+_DECODERS["json"] = json.loads
+_ENCODERS["json"] = _json_dumps
+
+# the fastest installed backend
+BACKEND = next(iter(_DECODERS))
+
+
+def get_backends() -> List[str]:
+    """
+    Returns the installed json backends, ordered by preference.
+    """
+    return list(_DECODERS.keys())
+
+
+def loads(data: Union[str, bytes], backend: Optional[str] = None) -> Any:
+    """
+    Decodes a json document (str or utf-8 bytes) using `backend`, or the
+    fastest installed backend if it's not set.
+    """
+    return _DECODERS[backend or BACKEND](data)
+
+
+def get_fields_decoder(
+    fields: List[str]
+) -> Callable[[Union[str, bytes]], Dict[str, Any]]:
+    """
+    Returns a decoder of json objects that returns only the `fields` of
+    the decoded object (missing fields are set to None).
+
+    With msgspec installed, the other fields are skipped while parsing
+    instead of being decoded and thrown away - large nested values that
+    are not needed cost a scan only, without allocating any objects.
+    """
+    if msgspec is None:
+        def decode(data: Union[str, bytes]) -> Dict[str, Any]:
+            obj = loads(data)
+            return {field: obj.get(field) for field in fields}
+        return decode
+
+    fields_type = msgspec.defstruct(
+        "Fields", [(field, Any, None) for field in fields]
+    )
+    decoder = msgspec.json.Decoder(fields_type)
+
+    def decode(data: Union[str, bytes]) -> Dict[str, Any]:
+        return msgspec.structs.asdict(decoder.decode(data))
+    return decode
+
+
+def dumps(
+    obj: Any,
+    indent: Optional[int] = None,
+    default: Optional[Callable[[Any], Any]] = None,
+    backend: Optional[str] = None
+) -> str:
+    """
+    Encodes `obj` to a json string using `backend`, or the fastest installed
+    backend if it's not set.
+
+    Unlike the stdlib json, orjson and msgspec write non-ASCII characters
+    as is (not escaped), hence the output should be written as utf-8.
+    """
+    return _ENCODERS[backend or BACKEND](obj, indent, default)
@@ -0,0 +1,242 @@
+from common.entities import Document, PromptingMode
+from common.utils import hash_file
+
+from typing import List, Tuple, Optional, Any
+from pathlib import Path
+import numpy as np
+import tempfile
+import logging
+import shutil
+import json
+import os
+
+
+# bump when the on-disk layout changes, so old cache entries are ignored
+_CACHE_VERSION = 2
+_META_FILE = "meta.json"
+_NONE_INDEX = -1
+
+
+def get_cache_path(
+    cache_dir: str,
+    file_path: str,
+    prompting_mode: PromptingMode
+) -> str:
+    """
+    Returns the cache entry path of the parsed `file_path` content.
+
+    The entry name holds the source file content hash, so a changed source
+    file maps to a new entry and the old one is never read again.
+    """
+    if prompting_mode is PromptingMode.OPENBOOK_RANDOM:
+        # openbook_random documents are parsed in their file order (and
+        # ordered later), hence the entry is shared with openbook
+        prompting_mode = PromptingMode.OPENBOOK
+
+    file_path = Path(file_path)
+    content_hash = hash_file(file_path)
+    entry_name = _get_entry_prefix(file_path, prompting_mode) + \
+        f"{content_hash[:16]}.v{_CACHE_VERSION}"
+    return f"{cache_dir}/{entry_name}"
+
+
+def exists(cache_path: str) -> bool:
+    return os.path.exists(f"{cache_path}/{_META_FILE}")
+
+
+def load(
+    cache_path: str
+) -> Optional[Tuple[List[str], List[List[str]], List[List[Document]]]]:
+    """
+    Loads a cache entry created by `save`, or returns None if it's missing.
+
+    The entry is fully loaded into the same lists a parsed file is read
+    into - the cache saves the json parsing time, not memory.
+    """
+    if not exists(cache_path):
+        return None
+
+    logging.info(f"Loading cached data file: {cache_path}")
+    with open(f"{cache_path}/{_META_FILE}") as f:
+        meta = json.load(f)
+    columns = {
+        name: np.load(f"{cache_path}/{name}.npy")
+        for name in meta["columns"]
+    }
+
+    strings = _decode_strings(columns["strings"], columns["string_offsets"])
+    questions = [strings[idx] for idx in columns["questions"].tolist()]
+    answers = _split(
+        [strings[idx] for idx in columns["answers"].tolist()],
+        columns["answer_offsets"]
+    )
+
+    if "document_offsets" not in columns:
+        return questions, answers, []
+
+    # the cached values were already validated when the file was parsed
+    documents = [
+        Document.from_dict({
+            "title": strings[title],
+            "text": strings[text],
+            "id": strings[id] if id != _NONE_INDEX else None,
+            "score": score if not np.isnan(score) else None,
+            "hasanswer": bool(hasanswer) if hasanswer != _NONE_INDEX else None,
+            "isgold": bool(isgold) if isgold != _NONE_INDEX else None,
+            "original_retrieval_index": (
+                original_retrieval_index
+                if original_retrieval_index != _NONE_INDEX else None
+            )
+        }, validate=False)
+        for (
+            title, text, id, score, hasanswer, isgold, original_retrieval_index
+        ) in zip(
+            columns["titles"].tolist(),
+            columns["texts"].tolist(),
+            columns["ids"].tolist(),
+            columns["scores"].tolist(),
+            columns["hasanswer"].tolist(),
+            columns["isgold"].tolist(),
+            columns["original_retrieval_index"].tolist()
+        )
+    ]
+    return questions, answers, _split(documents, columns["document_offsets"])
+
+
+def save(
+    cache_path: str,
+    questions: List[str],
+    answers: List[List[str]],
+    documents: List[List[Document]]
+) -> None:
+    """
+    Saves a parsed data file as a columnar cache entry - a folder with one
+    .npy file per column, where all strings are stored once in a shared
+    utf-8 blob and referenced by index.
+
+    The entry is written to a temporary folder and renamed into place, and
+    previous entries of the same source file are removed.
+    """
+    if not questions:
+        # an empty file is parsed as fast as it's loaded
+        return
+
+    cache_dir, entry_name = os.path.split(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    string_ids = {}
+
+    def get_string_id(value: Optional[str]) -> int:
+        if value is None:
+            return _NONE_INDEX
+        return string_ids.setdefault(value, len(string_ids))
+
+    columns = {
+        "questions": np.array(
+            [get_string_id(question) for question in questions],
+            dtype=np.int64
+        ),
+        "answers": np.array(
+            [get_string_id(answer) for sublist in answers for answer in sublist],
+            dtype=np.int64
+        ),
+        "answer_offsets": _get_offsets(answers)
+    }
+
+    if documents:
+        flat_documents = [doc for sublist in documents for doc in sublist]
+        columns.update({
+            "document_offsets": _get_offsets(documents),
+            "titles": np.array(
+                [get_string_id(doc.title) for doc in flat_documents],
+                dtype=np.int64
+            ),
+            "texts": np.array(
+                [get_string_id(doc.text) for doc in flat_documents],
+                dtype=np.int64
+            ),
+            "ids": np.array(
+                [get_string_id(doc.id) for doc in flat_documents],
+                dtype=np.int64
+            ),
+            "scores": np.array(
+                [
+                    doc.score if doc.score is not None else np.nan
+                    for doc in flat_documents
+                ],
+                dtype=np.float64
+            ),
+            "hasanswer": _get_optional_column(
+                [doc.hasanswer for doc in flat_documents], np.int8
+            ),
+            "isgold": _get_optional_column(
+                [doc.isgold for doc in flat_documents], np.int8
+            ),
+            "original_retrieval_index": _get_optional_column(
+                [doc.original_retrieval_index for doc in flat_documents],
+                np.int64
+            )
+        })
+
+    encoded_strings = [value.encode("utf-8") for value in string_ids]
+    columns["strings"] = np.frombuffer(b"".join(encoded_strings), dtype=np.uint8)
+    columns["string_offsets"] = _get_offsets(encoded_strings)
+
+    tmp_path = tempfile.mkdtemp(dir=cache_dir, prefix=f".{entry_name}.")
+    try:
+        for name, column in columns.items():
+            np.save(f"{tmp_path}/{name}.npy", column)
+        with open(f"{tmp_path}/{_META_FILE}", "w") as f:
+            json.dump({"columns": list(columns.keys())}, f)
+        _remove_stale_entries(cache_dir, entry_name)
+        os.replace(tmp_path, cache_path)
+        logging.info(f"Cached data file: {cache_path}")
+    except OSError:
+        # another process may have created the same entry concurrently
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not exists(cache_path):
+            raise
+
+
+def _get_entry_prefix(file_path: Path, prompting_mode: PromptingMode) -> str:
+    return f"{file_path.name}.{prompting_mode.value}."
+
+
+def _remove_stale_entries(cache_dir: str, entry_name: str) -> None:
+    # entries of the same source file and prompting mode that
+    # differ by their content hash / version are no longer valid
+    prefix = entry_name.rsplit(".", 2)[0] + "."
+    for existing in os.listdir(cache_dir):
+        if existing.startswith(prefix) and existing != entry_name:
+            logging.info(f"Removing stale cached data file: {existing}")
+            shutil.rmtree(f"{cache_dir}/{existing}", ignore_errors=True)
+
+
+def _get_offsets(sublists: List[Any]) -> np.ndarray:
+    offsets = np.zeros(len(sublists) + 1, dtype=np.int64)
+    np.cumsum([len(sublist) for sublist in sublists], out=offsets[1:])
+    return offsets
+
+
+def _get_optional_column(values: List[Optional[int]], dtype: Any) -> np.ndarray:
+    return np.array(
+        [value if value is not None else _NONE_INDEX for value in values],
+        dtype=dtype
+    )
+
+
+def _split(values: List[Any], offsets: np.ndarray) -> List[List[Any]]:
+    offsets = offsets.tolist()
+    return [
+        values[start:end]
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def _decode_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    buffer = memoryview(blob)
+    offsets = offsets.tolist()
+    return [
+        str(buffer[start:end], "utf-8")
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
@@ -1,154 +1,714 @@
-from common.entities import Document, PromptingMode
+from common.entities import Document, DocumentTable, PromptingMode
+import common.nq_cache as nq_cache
+import common.json_codec as json_codec
+import common.nq_index as nq_index
+import common.nq_shuffle as nq_shuffle
+from common.utils import hash_file
 
 from pathlib import Path
-from typing import List, Tuple, Dict, Union, Optional, Any
-from random import shuffle
-from copy import deepcopy
+from typing import (
+    List, Tuple, Dict, Union, Optional, Iterator, Callable, Sequence, IO, Any
+)
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+)
+from functools import partial
+from array import array
+from itertools import islice
 from tqdm import tqdm
 
+import tempfile
+import hashlib
 import logging
-import shutil
 import gzip
-import json
 import os
 
+try:
+    # optional ISA-L based decompressor, a few times faster than zlib
+    from isal import igzip as gzip_reader
+except ImportError:
+    gzip_reader = gzip
+
+
+_DATA_FILE_EXT = ".jsonl"
+_COMPRESSED_DATA_FILE_EXT = ".jsonl.gz"
+# closedbook examples use only these fields, so the (much larger) ctxs
+# field isn't decoded at all
+_decode_closedbook_example = json_codec.get_fields_decoder(
+    ["question", "answers"]
+)
+
 
 def read_files_by_num_docs(
     folder_path: str,
-    prompting_mode: PromptingMode
+    prompting_mode: PromptingMode,
+    stream: Optional[bool] = False,
+    num_workers: Optional[int] = None,
+    seed: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    intern_documents: Optional[bool] = False,
+    max_examples: Optional[int] = None
 ) -> Dict[str, Dict[str, Union[List[str], List[List[Document]]]]]:
     """
     Reads all jsonl files from input folder and creats a file postfix based
     data object (used for gold_idx_change experiment).
+
+    If `stream` is True, files are not parsed up front - each key holds a
+    "stream" callable that lazily yields the file examples (see `iter_file`),
+    as (question, answers, documents, permutation) tuples.
+
+    If `num_workers` is larger than 1, files are parsed in parallel using a
+    pool of `num_workers` processes (see `_read_files`).
+
+    On openbook_random mode, the documents lists keep the file order and
+    each key also holds the "permutations" of its examples, generated by
+    `seed` (see `common.nq_shuffle`), to be applied when prompts are built.
+
+    `cache_dir` is passed to `read_file`.
+
+    If `intern_documents` is True, every distinct document is stored once in
+    a `DocumentTable` shared by all keys (under "document_table") and the
+    "documents" lists hold index arrays into that table.
+
+    If `max_examples` is set, only the first `max_examples` examples of
+    each file are read (see `read_file`).
     """
     folder_path = Path(folder_path)
     logging.info(f"Creating documents from {folder_path} folder...")
 
-    jsonl_files = list(folder_path.glob("*.jsonl"))
-    files_data = {}
+    jsonl_files = _list_data_files(folder_path)
 
     if prompting_mode is PromptingMode.CLOSEDBOOK:
-        questions, answers, _ = read_file(
-            # we need only one file since we don't use documents and this
-            # is what changes between files
-            file_path=jsonl_files[0], prompting_mode=prompting_mode
-        )
-        files_data.update({
-            prompting_mode.value: {
-                "questions": questions,
-                "answers": answers
-            }
-        })
-
+        # we need only one file since we don't use documents and this
+        # is what changes between files
+        file_paths = {prompting_mode.value: jsonl_files[0]}
     else:
-        for jsonl in jsonl_files:
-            questions, answers, documents = read_file(
-                file_path=jsonl, prompting_mode=prompting_mode
-            )
-            # stem should look like the following:
-            # nq-open-10_total_documents_gold_at_0
-            # hence - split("_documents_")[-1] - will
-            # create a short name such as "gold_at_0"
-            file_short_name = jsonl.stem.split("_documents_")[-1]
-            files_data.update({
-                file_short_name: {
-                    "questions": questions,
-                    "answers": answers,
-                    "documents": documents
-                }
-            })
-
-    return files_data
+        # stem should look like the following:
+        # nq-open-10_total_documents_gold_at_0
+        # hence - split("_documents_")[-1] - will
+        # create a short name such as "gold_at_0"
+        file_paths = {
+            _get_file_stem(jsonl).split("_documents_")[-1]: jsonl
+            for jsonl in jsonl_files
+        }
+
+    return _get_files_data(
+        file_paths,
+        prompting_mode,
+        stream,
+        num_workers,
+        seed,
+        cache_dir,
+        intern_documents,
+        max_examples
+    )
 
 
 def read_files_by_gold_idx(
     folder_paths: List[str],
     prompting_mode: PromptingMode,
-    gold_idx: int
+    gold_idx: int,
+    stream: Optional[bool] = False,
+    num_workers: Optional[int] = None,
+    seed: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    intern_documents: Optional[bool] = False,
+    max_examples: Optional[int] = None
 ) -> Dict[str, Dict[str, Union[List[str], List[List[Document]]]]]:
     """
     Reads a jsonl file that ends with `gold_idx` postfix from input folder
     and creats a file prefix based data object (used for num_docs_change
     experiment).
+
+    If `stream` is True, files are not parsed up front - each key holds a
+    "stream" callable that lazily yields the file examples (see `iter_file`),
+    as (question, answers, documents, permutation) tuples.
+
+    If `num_workers` is larger than 1, files are parsed in parallel using a
+    pool of `num_workers` processes (see `_read_files`).
+
+    On openbook_random mode, the documents lists keep the file order and
+    each key also holds the "permutations" of its examples, generated by
+    `seed` (see `common.nq_shuffle`), to be applied when prompts are built.
+
+    `cache_dir` is passed to `read_file`.
+
+    If `intern_documents` is True, every distinct document is stored once in
+    a `DocumentTable` shared by all keys (under "document_table") and the
+    "documents" lists hold index arrays into that table.
+
+    If `max_examples` is set, only the first `max_examples` examples of
+    each file are read (see `read_file`).
     """
-    suffix = f"gold_at_{gold_idx}.jsonl"
-    file_paths = [
-        next(file for file in Path(folder).glob(f"*{suffix}"))
-        for folder in folder_paths
-    ]
+    suffix = f"gold_at_{gold_idx}"
     logging.info(f"Creating documents from relevant gold_idx={gold_idx} files...")
 
-    files_data = {}
-    for file_path in file_paths:
-        questions, answers, documents = read_file(file_path, prompting_mode)
+    file_paths = {}
+    for folder in folder_paths:
+        file_path = _list_data_files(Path(folder), f"*{suffix}")[0]
         # stem should look like the following:
         # nq-open-10_total_documents_gold_at_0
         # hence - replace("nq-open-", "") will remove the "nq-open-" and
         # split("_gold_")[0] - will create a short name such as
         # "10_total_documents"
         file_short_name =\
-            file_path.stem.replace("nq-open-", "").split("_gold_")[0]
-        files_data.update({
-            file_short_name: {
-                "questions": questions,
-                "answers": answers,
-                "documents": documents
-            }
-        })
+            _get_file_stem(file_path).replace("nq-open-", "").split("_gold_")[0]
+        file_paths[file_short_name] = file_path
+
+    return _get_files_data(
+        file_paths,
+        prompting_mode,
+        stream,
+        num_workers,
+        seed,
+        cache_dir,
+        intern_documents,
+        max_examples
+    )
+
+
+def _get_files_data(
+    file_paths: Dict[str, Path],
+    prompting_mode: PromptingMode,
+    stream: bool,
+    num_workers: Optional[int],
+    seed: Optional[int],
+    cache_dir: Optional[str],
+    intern_documents: bool,
+    max_examples: Optional[int]
+) -> Dict[str, Dict[str, Union[List[str], List[List[Document]]]]]:
+
+    if prompting_mode is PromptingMode.OPENBOOK_RANDOM:
+        seed = nq_shuffle.get_seed(seed)
+        logging.info(f"Ordering openbook_random documents using seed={seed}")
+
+    if stream is True:
+        return {
+            key: _get_stream_entry(
+                file_path, prompting_mode, seed, max_examples
+            )
+            for key, file_path in file_paths.items()
+        }
+
+    document_table = None
+    if intern_documents is True and prompting_mode is not PromptingMode.CLOSEDBOOK:
+        document_table = DocumentTable()
+
+    files_data = {}
+    files_content = _read_files(
+        file_paths=list(file_paths.values()),
+        prompting_mode=prompting_mode,
+        num_workers=num_workers,
+        cache_dir=cache_dir,
+        max_examples=max_examples
+    )
+    for key, (questions, answers, documents) in zip(
+        file_paths.keys(), files_content
+    ):
+        files_data[key] = {"questions": questions, "answers": answers}
+        if prompting_mode is PromptingMode.CLOSEDBOOK:
+            continue
+
+        if prompting_mode is PromptingMode.OPENBOOK_RANDOM:
+            # only the documents order is stored, so the documents lists
+            # aren't copied (and the file content can be cached as is)
+            files_data[key]["permutations"] = nq_shuffle.get_permutations(
+                documents, seed
+            )
+
+        if document_table is not None:
+            # files are interned one by one, so the duplicated documents of
+            # each file are released before the next file is read
+            documents = [
+                document_table.intern(example_documents)
+                for example_documents in documents
+            ]
+            files_data[key]["document_table"] = document_table
+        files_data[key]["documents"] = documents
 
     return files_data
 
 
+def _read_files(
+    file_paths: List[Path],
+    prompting_mode: PromptingMode,
+    num_workers: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    max_examples: Optional[int] = None
+) -> Iterator[Tuple[List[str], List[List[str]], List[List[Document]]]]:
+    """
+    Reads `file_paths` and yields their content in the same order, one file
+    at a time. On openbook_random mode, the documents keep the file order.
+
+    If `cache_dir` is set, files that were already parsed are loaded from
+    the cache (see `common.nq_cache`) and the rest are cached once parsed.
+    The cache holds entire files, hence it's not used when `max_examples`
+    is set - parsing the first few lines is cheaper than loading the entry.
+    """
+    use_cache = cache_dir is not None and max_examples is None
+    cache_paths = [
+        nq_cache.get_cache_path(cache_dir, file_path, prompting_mode)
+        if use_cache is True else None
+        for file_path in file_paths
+    ]
+    is_cached = [
+        cache_path is not None and nq_cache.exists(cache_path)
+        for cache_path in cache_paths
+    ]
+
+    parsed_files_content = _parse_files(
+        file_paths=[
+            file_path
+            for file_path, cached in zip(file_paths, is_cached)
+            if cached is False
+        ],
+        prompting_mode=prompting_mode,
+        num_workers=num_workers,
+        max_examples=max_examples
+    )
+
+    for cache_path, cached in zip(cache_paths, is_cached):
+        if cached is True:
+            yield nq_cache.load(cache_path)
+            continue
+
+        file_content = next(parsed_files_content)
+        if cache_path is not None:
+            nq_cache.save(cache_path, *file_content)
+        yield file_content
+
+
+def _parse_files(
+    file_paths: List[Path],
+    prompting_mode: PromptingMode,
+    num_workers: Optional[int] = None,
+    max_examples: Optional[int] = None
+) -> Iterator[Tuple[List[str], List[List[str]], List[List[Document]]]]:
+    """
+    Parses `file_paths` (up to `max_examples` examples of each) and yields
+    their content in the same order (without ordering the openbook_random
+    documents).
+
+    With more than one worker, every file is split into line-range shards
+    (so a single large file is also spread across cores), the shards are
+    parsed by a process pool and merged back per file.
+    """
+    if not file_paths:
+        return
+
+    if num_workers is None or num_workers <= 1:
+        for file_path in file_paths:
+            yield _read_file_content(
+                file_path, prompting_mode, stop=max_examples
+            )
+        return
+
+    shards_per_file = max(1, num_workers // len(file_paths))
+    logging.info(
+        f"Reading {len(file_paths)} files using {num_workers} workers " +
+        f"[shards_per_file={shards_per_file}]..."
+    )
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        files_futures = [
+            [
+                executor.submit(
+                    _read_file_content, file_path, prompting_mode, start, stop
+                )
+                # uncompressed shards seek to their first line using the
+                # offset index, but compressed files can't be skipped
+                # without inflating them, so each one is read by a
+                # single worker
+                for start, stop in _get_line_ranges(
+                    file_path,
+                    1 if _is_compressed(file_path) else shards_per_file,
+                    max_examples
+                )
+            ]
+            for file_path in file_paths
+        ]
+
+        for file_futures in files_futures:
+            all_questions, all_answers, all_documents = [], [], []
+            for future in file_futures:
+                questions, answers, documents = future.result()
+                all_questions.extend(questions)
+                all_answers.extend(answers)
+                all_documents.extend(documents)
+            yield all_questions, all_answers, all_documents
+
+
+def _get_line_ranges(
+    file_path: str,
+    num_shards: int,
+    max_examples: Optional[int] = None
+) -> List[Tuple[int, Optional[int]]]:
+
+    if num_shards == 1:
+        # a single shard reads the file up to its end, no need to count
+        return [(0, max_examples)]
+
+    num_lines = _count_lines(file_path)
+    if max_examples is not None:
+        num_lines = min(num_lines, max_examples)
+    shard_size = -(-num_lines // num_shards) or 1
+    return [
+        (start, min(start + shard_size, num_lines))
+        for start in range(0, num_lines, shard_size)
+    ] or [(0, 0)]
+
+
+def _count_lines(file_path: str) -> int:
+    if not _is_compressed(file_path):
+        return len(nq_index.get_offsets(file_path)) - 1
+
+    num_lines = 0
+    last_chunk = b""
+    with _open_data_file(file_path, "rb") as fin:
+        while chunk := fin.read(1 << 20):
+            num_lines += chunk.count(b"\n")
+            last_chunk = chunk
+    # the last line may not end with a new line
+    if last_chunk and not last_chunk.endswith(b"\n"):
+        num_lines += 1
+    return num_lines
+
+
+def _list_data_files(
+    folder_path: Path,
+    pattern: Optional[str] = "*"
+) -> List[Path]:
+    """
+    Lists the NQ data files (.jsonl / .jsonl.gz) in `folder_path` that match
+    the `pattern` file stem. If both versions of a file exist, the extracted
+    .jsonl one is preferred.
+    """
+    data_files = {}
+    for extension in _COMPRESSED_DATA_FILE_EXT, _DATA_FILE_EXT:
+        for file_path in sorted(folder_path.glob(f"{pattern}{extension}")):
+            data_files[_get_file_stem(file_path)] = file_path
+    return list(data_files.values())
+
+
+def _get_file_stem(file_path: Path) -> str:
+    # Path.stem will only remove the last suffix
+    # (nq-open-10_total_documents_gold_at_0.jsonl.gz -->
+    # nq-open-10_total_documents_gold_at_0.jsonl)
+    name = file_path.name
+    for extension in _COMPRESSED_DATA_FILE_EXT, _DATA_FILE_EXT:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return file_path.stem
+
+
+def _is_compressed(file_path: str) -> bool:
+    return str(file_path).endswith(".gz")
+
+
+def _open_data_file(file_path: str, mode: Optional[str] = "rt") -> IO:
+    if _is_compressed(file_path):
+        return gzip_reader.open(file_path, mode)
+    return open(file_path, mode)
+
+
 def read_file(
     file_path: str,
-    prompting_mode: PromptingMode
+    prompting_mode: PromptingMode,
+    start: Optional[int] = 0,
+    stop: Optional[int] = None,
+    seed: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    validate_documents: Optional[bool] = False,
+    max_examples: Optional[int] = None
 ) -> Tuple[List[str], List[List[str]], List[List[Document]]]:
     """
     Reads NQ dataset file using `file_path` and creates a list of lists
     of documents with a matching list of questions.
+
+    Only the examples within the [`start`, `stop`) line range are read.
+    If `max_examples` is set, reading stops after `max_examples` examples
+    (the rest of the file is never read).
+
+    `seed` and `validate_documents` are used as in `iter_file`.
+
+    If `cache_dir` is set, the parsed content of the entire file is cached
+    there and loaded on the next reads, until the file content changes.
     """
+    if max_examples is not None:
+        max_stop = start + max_examples
+        stop = max_stop if stop is None else min(stop, max_stop)
+
+    if cache_dir is not None and start == 0 and stop is None:
+        questions, answers, documents = next(_read_files(
+            [file_path], prompting_mode, cache_dir=cache_dir
+        ))
+    else:
+        questions, answers, documents = _read_file_content(
+            file_path, prompting_mode, start, stop, validate_documents
+        )
+
+    if prompting_mode is PromptingMode.OPENBOOK_RANDOM:
+        permutations = nq_shuffle.get_permutations(
+            documents,
+            nq_shuffle.get_seed(seed),
+            range(start, start + len(documents))
+        )
+        documents = [
+            nq_shuffle.apply(example_documents, permutation)
+            for example_documents, permutation in zip(documents, permutations)
+        ]
+
+    return questions, answers, documents
+
+
+def _read_file_content(
+    file_path: str,
+    prompting_mode: PromptingMode,
+    start: Optional[int] = 0,
+    stop: Optional[int] = None,
+    validate_documents: Optional[bool] = False
+) -> Tuple[List[str], List[List[str]], List[List[Document]]]:
+    # reads the [`start`, `stop`) examples, with the openbook_random
+    # documents in their file order
     all_questions = []
     all_documents = []
     all_answers = []
 
-    with open(file_path) as fin:
-        for line in tqdm(fin):
-            input_example = json.loads(line)
-            # get example's question
-            question = input_example["question"]
-            all_questions.append(question)
-            # get example's answers
-            answers = input_example["answers"]
-            all_answers.append(answers)
-            if prompting_mode is PromptingMode.CLOSEDBOOK:
-                # closedbook doesn not need context document - 
-                # we're returning and empty list
-                continue
-            else:
-                documents = []
-                for ctx in deepcopy(input_example["ctxs"]):
-                    documents.append(Document.from_dict(ctx))
-                if not documents:
-                    raise ValueError(f"Did not find any documents for example: {input_example}")
-
-            if prompting_mode is PromptingMode.OPENBOOK_RANDOM:
-                # Randomly order only the distractors (isgold is False), keeping isgold documents
-                # at their existing index.
-                (original_gold_index,) = [idx for idx, doc in enumerate(documents) if doc.isgold is True]
-                original_gold_document = documents[original_gold_index]
-                distractors = [doc for doc in documents if doc.isgold is False]
-                shuffle(distractors)
-                distractors.insert(original_gold_index, original_gold_document)
-                documents = distractors
+    examples = _iter_file_examples(
+        file_path, prompting_mode, start, stop, validate_documents
+    )
+    for _, (question, answers, documents) in examples:
+        all_questions.append(question)
+        all_answers.append(answers)
+        if documents is not None:
+            all_documents.append(documents)
+
+    return all_questions, all_answers, all_documents
+
+
+def iter_file(
+    file_path: str,
+    prompting_mode: PromptingMode,
+    start: Optional[int] = 0,
+    stop: Optional[int] = None,
+    seed: Optional[int] = None,
+    validate_documents: Optional[bool] = False
+) -> Iterator[Tuple[str, List[str], Optional[List[Document]]]]:
+    """
+    Lazily reads NQ dataset file using `file_path` and yields one
+    (question, answers, documents) example at a time, so only the examples
+    currently being consumed are kept in memory.
 
+    Only the examples within the [`start`, `stop`) line range are parsed.
+    On uncompressed files the reader seeks directly to `start` using the
+    file offset index (see `common.nq_index`), lines of compressed files
+    before `start` are skipped without being decoded.
+
+    Compressed (.jsonl.gz) files are decompressed on the fly.
+
+    On openbook_random mode, the distractors of each example are ordered
+    by `seed` and the example line index (see `common.nq_shuffle`), so the
+    order doesn't depend on how the file is read (e.g. in shards). If
+    `seed` is not set, a random seed is used.
+
+    Documents are created without pydantic validation, unless
+    `validate_documents` is True (see `Document.from_dict`).
+
+    On closedbook mode the yielded documents are None.
+    """
+    examples = _iter_file_permuted_examples(
+        file_path, prompting_mode, start, stop, seed, validate_documents
+    )
+    for question, answers, documents, permutation in examples:
+        if permutation is not None:
+            documents = nq_shuffle.apply(documents, permutation)
+        yield question, answers, documents
+
+
+def _iter_file_permuted_examples(
+    file_path: str,
+    prompting_mode: PromptingMode,
+    start: Optional[int] = 0,
+    stop: Optional[int] = None,
+    seed: Optional[int] = None,
+    validate_documents: Optional[bool] = False
+) -> Iterator[
+    Tuple[str, List[str], Optional[List[Document]], Optional[Sequence[int]]]
+]:
+    # yields the `iter_file` examples with their documents in the file
+    # order, and the openbook_random permutation of each example (None on
+    # the other modes)
+    if prompting_mode is PromptingMode.OPENBOOK_RANDOM:
+        seed = nq_shuffle.get_seed(seed)
+
+    examples = _iter_file_examples(
+        file_path, prompting_mode, start, stop, validate_documents
+    )
+    for line_idx, (question, answers, documents) in examples:
+        permutation = None
+        if prompting_mode is PromptingMode.OPENBOOK_RANDOM:
+            (permutation,) = nq_shuffle.get_permutations(
+                [documents], seed, [line_idx]
+            )
+        yield question, answers, documents, permutation
+
+
+def _iter_file_examples(
+    file_path: str,
+    prompting_mode: PromptingMode,
+    start: Optional[int] = 0,
+    stop: Optional[int] = None,
+    validate_documents: Optional[bool] = False
+) -> Iterator[Tuple[int, Tuple[str, List[str], Optional[List[Document]]]]]:
+    # yields the examples with their line index, with the openbook_random
+    # documents in their file order
+
+    # lines are read as bytes and decoded by the json backend itself
+    with _open_data_file(file_path, "rb") as fin:
+        lines = _iter_lines(fin, file_path, start, stop)
+        for line_idx, line in enumerate(tqdm(lines), start):
+            yield line_idx, _parse_example(
+                line, prompting_mode, validate_documents
+            )
+
+
+def read_examples(
+    file_path: str,
+    prompting_mode: PromptingMode,
+    line_indices: List[int],
+    seed: Optional[int] = None,
+    validate_documents: Optional[bool] = False
+) -> Tuple[List[str], List[List[str]], List[List[Document]]]:
+    """
+    Reads only the examples at `line_indices` (in the given order) of NQ
+    dataset file using `file_path`, e.g. for subsampling.
+
+    On uncompressed files each example line is read directly by its offset
+    (see `common.nq_index`), so the cost depends on the number of examples
+    and not on the file size.
+
+    `seed` and `validate_documents` are used as in `iter_file`, hence an
+    example is identical to the one read by `read_file`.
+    """
+    with _open_data_file(file_path, "rb") as fin:
+        if _is_compressed(file_path):
+            wanted_indices = set(line_indices)
+            lines = {
+                line_idx: line
+                for line_idx, line in enumerate(
+                    islice(fin, max(line_indices, default=-1) + 1)
+                )
+                if line_idx in wanted_indices
+            }
+        else:
+            offsets = nq_index.get_offsets(file_path)
+            lines = {}
+            for line_idx in line_indices:
+                fin.seek(int(offsets[line_idx]))
+                lines[line_idx] = fin.readline()
+
+    all_questions = []
+    all_documents = []
+    all_answers = []
+
+    for line_idx in line_indices:
+        question, answers, documents = _parse_example(
+            lines[line_idx], prompting_mode, validate_documents
+        )
+        all_questions.append(question)
+        all_answers.append(answers)
+        if documents is not None:
             all_documents.append(documents)
 
+    if prompting_mode is PromptingMode.OPENBOOK_RANDOM:
+        permutations = nq_shuffle.get_permutations(
+            all_documents, nq_shuffle.get_seed(seed), line_indices
+        )
+        all_documents = [
+            nq_shuffle.apply(documents, permutation)
+            for documents, permutation in zip(all_documents, permutations)
+        ]
+
     return all_questions, all_answers, all_documents
 
 
+def _iter_lines(
+    fin: IO,
+    file_path: str,
+    start: int,
+    stop: Optional[int]
+) -> Iterator[bytes]:
+
+    if not start or _is_compressed(file_path):
+        return islice(fin, start, stop)
+
+    offsets = nq_index.get_offsets(file_path)
+    start = min(start, len(offsets) - 1)
+    fin.seek(int(offsets[start]))
+    return islice(fin, None if stop is None else max(stop - start, 0))
+
+
+def _parse_example(
+    line: bytes,
+    prompting_mode: PromptingMode,
+    validate_documents: Optional[bool] = False
+) -> Tuple[str, List[str], Optional[List[Document]]]:
+    # openbook_random documents are returned in their file order, see
+    # `common.nq_shuffle` for the distractors ordering
+
+    if prompting_mode is PromptingMode.CLOSEDBOOK:
+        input_example = _decode_closedbook_example(line)
+        # closedbook doesn not need context document -
+        # we're returning None instead of a documents list
+        return input_example["question"], input_example["answers"], None
+
+    input_example = json_codec.loads(line)
+    # get example's question
+    question = input_example["question"]
+    # get example's answers
+    answers = input_example["answers"]
+
+    # the decoded ctxs are owned by this example only, hence documents
+    # are created from them directly (no copies)
+    documents = [
+        Document.from_dict(ctx, validate=validate_documents)
+        for ctx in input_example["ctxs"]
+    ]
+    if not documents:
+        raise ValueError(f"Did not find any documents for example: {input_example}")
+
+    return question, answers, documents
+
+
+def _get_stream_entry(
+    file_path: str,
+    prompting_mode: PromptingMode,
+    seed: Optional[int] = None,
+    max_examples: Optional[int] = None
+) -> Dict[str, Callable[[], Iterator]]:
+    # the callable re-opens the file on every call, so a data key can be
+    # iterated more than once (e.g. when an experiment is re-run). like the
+    # read documents lists, the streamed ones keep the file order and are
+    # yielded with their openbook_random permutations
+    return {
+        "stream": partial(
+            _iter_file_permuted_examples,
+            file_path=file_path,
+            prompting_mode=prompting_mode,
+            stop=max_examples,
+            seed=seed
+        )
+    }
+
+
 def serialize(obj: Any) -> Dict[str, str]:
     if isinstance(obj, Document):
         return obj.to_dict()
+    elif isinstance(obj, DocumentTable):
+        return [doc.to_dict() for doc in obj.resolve(range(len(obj)))]
+    elif isinstance(obj, array):
+        # interned documents indices
+        return obj.tolist()
     elif (
         isinstance(obj, list) and
         isinstance(obj[0], list) and
@@ -162,10 +722,35 @@ def serialize(obj: Any) -> Dict[str, str]:
         return obj
 
 
+def get_src_folder_by_num_docs(num_docs: int, src_dir: str) -> str:
+    """
+    Returns the lost-in-the-middle local cloned git repo folder at `src_dir`
+    that holds the (compressed) NQ dataset files of `num_docs` documents.
+    """
+    # lost in the middle suppose to have one folder
+    # for each number of test documents
+    return [
+        src_folder for src_folder in get_src_folders(src_dir)
+        if os.path.basename(src_folder).startswith(str(num_docs))
+    ][0]
+
+
+def get_src_folders(src_dir: str) -> List[str]:
+    """
+    Returns all the lost-in-the-middle local cloned git repo folders at
+    `src_dir` that hold (compressed) NQ dataset files.
+    """
+    return [
+        f"{src_dir}/{f}" for f in os.listdir(src_dir)
+            if os.path.isdir(os.path.join(src_dir, f))
+    ]
+
+
 def download_files_by_num_docs(
     num_docs: int,
     dst_dir: str,
-    src_dir: str
+    src_dir: str,
+    num_workers: Optional[int] = None
 ) -> str:
     """
     Downloads the NQ dataset filesfrom the lost-in-the-middle local cloned git
@@ -176,28 +761,23 @@ def download_files_by_num_docs(
 
     Skipping any existing `src_file` from `src_dir` during the download
     process.
+
+    See `download_folder_files` for `num_workers`.
     """
     logging.info(f"Downloading NQ Data [num_docs={num_docs}]...")
-    # lost in the middle suppose to have one folder
-    # for each number of test documents
-    data_folder = [
-        f for f in os.listdir(src_dir)
-        if os.path.isdir(os.path.join(src_dir, f))
-            and f.startswith(str(num_docs))
-    ][0]
-
-    src_folder = f"{src_dir}/{data_folder}"
-    dst_folder = f"{dst_dir}/{data_folder}"
+    src_folder = get_src_folder_by_num_docs(num_docs, src_dir)
+    dst_folder = f"{dst_dir}/{os.path.basename(src_folder)}"
     os.makedirs(dst_folder, exist_ok=True)
 
-    download_folder_files(dst_folder, src_folder)
+    download_folder_files(dst_folder, src_folder, num_workers=num_workers)
     return dst_folder
 
 
 def download_files_by_gold_idx(
     gold_idx: int,
     dst_dir: str,
-    src_dir: str
+    src_dir: str,
+    num_workers: Optional[int] = None
 ) -> List[str]:
     """
     Downloads the NQ dataset files that has a `gold_idx` posfix from the
@@ -208,33 +788,76 @@ def download_files_by_gold_idx(
 
     Skipping any existing `src_file` from `src_dir` during the download
     process.
+
+    The files of all folders are extracted by a single pool of `num_workers`
+    threads (see `download_folder_files`).
     """
     logging.info(f"Downloading NQ Data [gold_idx={gold_idx}]...")
-    data_folders = [
-        f for f in os.listdir(src_dir)
-            if os.path.isdir(os.path.join(src_dir, f))
-    ]
-    dst_folders = []
+    folders = []
 
-    for data_folder in data_folders:
-        src_folder = f"{src_dir}/{data_folder}"
-        dst_folder = f"{dst_dir}/{data_folder}"
+    for src_folder in get_src_folders(src_dir):
+        dst_folder = f"{dst_dir}/{os.path.basename(src_folder)}"
         os.makedirs(dst_folder, exist_ok=True)
-        postfix = f"gold_at_{gold_idx}.jsonl.gz"
-        download_folder_files(dst_folder, src_folder, postfix)
-        dst_folders.append(dst_folder)
+        folders.append((dst_folder, src_folder))
 
-    return dst_folders
+    postfix = f"gold_at_{gold_idx}.jsonl.gz"
+    _download_folders_files(folders, postfix, num_workers)
+    return [dst_folder for dst_folder, _ in folders]
 
 
 def download_folder_files(
     dst_folder: str,
     src_folder: str,
-    postfix: Optional[str] = None
+    postfix: Optional[str] = None,
+    num_workers: Optional[int] = None
+) -> None:
+    """
+    Extracts the compressed files of `src_folder` into `dst_folder`.
+
+    Files are extracted by a pool of `num_workers` threads (decompression
+    releases the GIL). Each file is written to a temporary file that is
+    renamed into place once complete, and recorded with its size and
+    checksum in the `dst_folder` manifest (see `verify_folder_files`).
+
+    Existing files are skipped only if they match their manifest size, so
+    files left by an interrupted extraction are extracted again.
+    """
+    _download_folders_files([(dst_folder, src_folder)], postfix, num_workers)
+
+
+def verify_folder_files(dst_folder: str) -> List[str]:
+    """
+    Returns the names of the `dst_folder` extracted files that are missing
+    or don't match their manifest checksum.
+    """
+    manifest = _load_manifest(dst_folder)
+    invalid_files = []
+    for file_name, file_manifest in manifest.items():
+        dst_file = f"{dst_folder}/{file_name}"
+        if (
+            not _is_extracted(manifest, dst_file) or
+            hash_file(dst_file) != file_manifest["blake2b"]
+        ):
+            invalid_files.append(file_name)
+    return invalid_files
+
+
+def _download_folders_files(
+    folders: List[Tuple[str, str]],
+    postfix: Optional[str] = None,
+    num_workers: Optional[int] = None
 ) -> None:
 
-    for file_name in os.listdir(src_folder):
-        if file_name.endswith(".gz"):
+    manifests = {
+        dst_folder: _load_manifest(dst_folder) for dst_folder, _ in folders
+    }
+    extractions = []
+
+    for dst_folder, src_folder in folders:
+        for file_name in os.listdir(src_folder):
+            if not file_name.endswith(".gz"):
+                continue
+
             src_file = f"{src_folder}/{file_name}"
             dst_file = f"{dst_folder}/{file_name.replace('.gz', '')}"
             if (
@@ -247,13 +870,84 @@ def download_folder_files(
                 )
                 continue
 
-            if not os.path.exists(dst_file):
-                with(
-                    gzip.open(src_file, "rb") as f_in,
-                    open(dst_file, "wb") as f_out
-                ):
-                    logging.info(f"Downloading file: {src_file} to: {dst_file}")
-                    shutil.copyfileobj(f_in, f_out)
-
-            else:
+            if _is_extracted(manifests[dst_folder], dst_file):
                 logging.info(f"Skipping existing file [file exists]: {src_file}")
+                continue
+
+            logging.info(f"Downloading file: {src_file} to: {dst_file}")
+            extractions.append((dst_folder, src_file, dst_file))
+
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers or 1) as executor:
+            futures = {
+                executor.submit(_extract_file, src_file, dst_file):
+                    (dst_folder, dst_file)
+                for dst_folder, src_file, dst_file in extractions
+            }
+            for future in as_completed(futures):
+                dst_folder, dst_file = futures[future]
+                manifests[dst_folder][os.path.basename(dst_file)] =\
+                    future.result()
+    finally:
+        # recording the completed extractions, even if others failed
+        for dst_folder, manifest in manifests.items():
+            _save_manifest(dst_folder, manifest)
+
+
+def _extract_file(src_file: str, dst_file: str) -> Dict[str, Any]:
+    dst_folder, dst_name = os.path.split(dst_file)
+    fd, tmp_file = tempfile.mkstemp(dir=dst_folder, prefix=f".{dst_name}.")
+    hasher = hashlib.blake2b()
+    size = 0
+    try:
+        with (
+            gzip_reader.open(src_file, "rb") as f_in,
+            os.fdopen(fd, "wb") as f_out
+        ):
+            while chunk := f_in.read(1 << 20):
+                hasher.update(chunk)
+                f_out.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_file, dst_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return {"size": size, "blake2b": hasher.hexdigest()}
+
+
+def _is_extracted(manifest: Dict[str, Dict[str, Any]], dst_file: str) -> bool:
+    # a quick check - the full checksum is validated by `verify_folder_files`
+    file_manifest = manifest.get(os.path.basename(dst_file))
+    return (
+        file_manifest is not None and
+        os.path.exists(dst_file) and
+        os.path.getsize(dst_file) == file_manifest["size"]
+    )
+
+
+def _get_manifest_path(dst_folder: str) -> str:
+    # kept next to the folder (and not inside it), so the folder
+    # holds only the data files
+    return f"{dst_folder.rstrip('/')}.manifest.json"
+
+
+def _load_manifest(dst_folder: str) -> Dict[str, Dict[str, Any]]:
+    manifest_path = _get_manifest_path(dst_folder)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json_codec.loads(f.read())
+
+
+def _save_manifest(
+    dst_folder: str,
+    manifest: Dict[str, Dict[str, Any]]
+) -> None:
+
+    manifest_path = _get_manifest_path(dst_folder)
+    manifest_dir, manifest_name = os.path.split(manifest_path)
+    fd, tmp_path = tempfile.mkstemp(dir=manifest_dir, prefix=f".{manifest_name}.")
+    with os.fdopen(fd, "w") as f:
+        f.write(json_codec.dumps(manifest, indent=2))
+    os.replace(tmp_path, manifest_path)
@@ -0,0 +1,76 @@
+from typing import Optional
+import numpy as np
+import tempfile
+import logging
+import os
+
+
+_INDEX_FILE_EXT = ".offsets.npy"
+_NEW_LINE = ord("\n")
+
+
+def get_offsets(file_path: str) -> np.ndarray:
+    """
+    Returns the byte offset index of an (uncompressed) NQ dataset file - an
+    int64 array where `offsets[i]` is the byte offset of line `i` and the
+    last item is the file size, so the file has `len(offsets) - 1` lines.
+
+    The index is loaded from a sidecar file next to the data file, and is
+    (re)built if it's missing or the data file has changed since.
+    """
+    index_path = f"{file_path}{_INDEX_FILE_EXT}"
+    offsets = _load(index_path, file_path)
+    if offsets is not None:
+        return offsets
+
+    logging.info(f"Building offset index: {index_path}")
+    offsets = build(file_path)
+    _save(index_path, offsets)
+    return offsets
+
+
+def build(file_path: str) -> np.ndarray:
+    """
+    Scans `file_path` and returns its byte offset index (see `get_offsets`).
+    """
+    line_ends = []
+    position = 0
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1 << 24):
+            buffer = np.frombuffer(chunk, dtype=np.uint8)
+            line_ends.append(np.flatnonzero(buffer == _NEW_LINE) + position + 1)
+            position += len(chunk)
+
+    offsets = np.concatenate([np.zeros(1, dtype=np.int64), *line_ends])
+    # the last line may not end with a new line
+    if offsets[-1] != position:
+        offsets = np.append(offsets, position)
+    return offsets.astype(np.int64, copy=False)
+
+
+def _load(index_path: str, file_path: str) -> Optional[np.ndarray]:
+    if not os.path.exists(index_path):
+        return None
+
+    # an index that is older than its data file, or doesn't end with the
+    # data file size, belongs to a previous version of the file
+    file_stat = os.stat(file_path)
+    if os.stat(index_path).st_mtime < file_stat.st_mtime:
+        return None
+    offsets = np.load(index_path)
+    if offsets[-1] != file_stat.st_size:
+        return None
+    return offsets
+
+
+def _save(index_path: str, offsets: np.ndarray) -> None:
+    index_dir, index_name = os.path.split(index_path)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=f".{index_name}.")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, offsets)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        # the index is an optimization - a read-only data folder
+        # should not fail the read
+        logging.warning(f"Could not save offset index {index_path}: {e}")
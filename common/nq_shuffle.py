@@ -0,0 +1,129 @@
+from common.entities import Document
+
+from typing import List, Sequence, Optional, Union, Any
+from collections import defaultdict
+import numpy as np
+import random
+
+
+_UINT64_MAX = np.iinfo(np.uint64).max
+_UINT64_MASK = (1 << 64) - 1
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def get_seed(seed: Optional[int] = None) -> int:
+    """
+    Returns `seed`, or a new random seed if it's not set. The new seed is
+    drawn from the global `random` state, so unseeded runs still follow
+    `random.seed` like the `random.shuffle` based shuffling did.
+    """
+    return seed if seed is not None else random.getrandbits(63)
+
+
+def get_permutations(
+    documents_list: List[List[Document]],
+    seed: int,
+    line_indices: Optional[Sequence[int]] = None
+) -> List[np.ndarray]:
+    """
+    Returns the openbook_random documents order of each example - a
+    permutation that keeps the gold document at its index and randomly
+    orders the distractors around it.
+
+    The order of an example depends only on `seed` and the example line
+    index in its file (`line_indices`, consecutive from 0 if not set), so
+    an example is ordered the same whether its file is read entirely, in
+    shards or example by example.
+
+    The permutations of all examples with the same number of documents
+    are generated together in a single vectorized batch.
+    """
+    if line_indices is None:
+        line_indices = range(len(documents_list))
+    line_indices = np.asarray(line_indices, dtype=np.uint64)
+
+    examples_by_num_docs = defaultdict(list)
+    for example_idx, documents in enumerate(documents_list):
+        examples_by_num_docs[len(documents)].append(example_idx)
+
+    permutations = [None] * len(documents_list)
+    for num_docs, example_idxs in examples_by_num_docs.items():
+        is_gold = np.array(
+            [
+                [doc.isgold is True for doc in documents_list[example_idx]]
+                for example_idx in example_idxs
+            ],
+            dtype=bool
+        ).reshape(len(example_idxs), num_docs)
+        keys = _get_random_keys(seed, line_indices[example_idxs], num_docs)
+        group_permutations = _get_group_permutations(
+            is_gold, keys, line_indices[example_idxs]
+        )
+        for example_idx, permutation in zip(example_idxs, group_permutations):
+            permutations[example_idx] = permutation
+
+    return permutations
+
+
+def apply(
+    documents: Union[List[Document], Sequence[int]],
+    permutation: Sequence[int]
+) -> List[Any]:
+    """
+    Returns `documents` (or interned documents indices) in `permutation`
+    order.
+    """
+    return [documents[idx] for idx in permutation]
+
+
+def _get_group_permutations(
+    is_gold: np.ndarray,
+    keys: np.ndarray,
+    line_indices: np.ndarray
+) -> np.ndarray:
+
+    num_golds = is_gold.sum(axis=1)
+    if (num_golds != 1).any():
+        line_idx = line_indices[np.flatnonzero(num_golds != 1)[0]]
+        raise ValueError(
+            f"Expected a single gold document in example {line_idx}, " +
+            f"found {num_golds[num_golds != 1][0]}"
+        )
+
+    num_docs = is_gold.shape[1]
+    gold_idxs = is_gold.argmax(axis=1)[:, None]
+    # sorting by the random keys, with the gold document keyed last, gives
+    # the shuffled distractors followed by the gold document
+    order = np.argsort(
+        np.where(is_gold, _UINT64_MAX, keys >> np.uint64(1)),
+        axis=1,
+        kind="stable"
+    )
+    # the gold document is put back at its index and the distractors
+    # after it are shifted by one position
+    positions = np.arange(num_docs)
+    src_positions = positions - (positions > gold_idxs)
+    permutations = np.take_along_axis(order, src_positions, axis=1)
+    permutations = np.where(positions == gold_idxs, gold_idxs, permutations)
+    return permutations.astype(np.int32)
+
+
+def _get_random_keys(
+    seed: int,
+    line_indices: np.ndarray,
+    num_docs: int
+) -> np.ndarray:
+    # counter based random keys - each key is a hash of the seed, line
+    # index and document position, hence doesn't depend on the other
+    # examples in the batch
+    seed_key = _mix(np.array([seed & _UINT64_MASK], dtype=np.uint64))
+    line_keys = _mix(line_indices ^ seed_key)
+    positions = np.arange(num_docs, dtype=np.uint64)
+    return _mix(line_keys[:, None] + positions * _GOLDEN_GAMMA)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    # the splitmix64 finalizer (unsigned arrays wrap around on overflow)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
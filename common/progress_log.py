@@ -0,0 +1,132 @@
+import common.json_codec as json_codec
+
+from typing import List, Dict, Tuple, Optional, Any
+from collections import defaultdict
+import hashlib
+import logging
+import fcntl
+import os
+
+
+def get_progress_log_path(progress_dir: str, config: Dict[str, Any]) -> str:
+    """
+    Returns the progress log path of a run with `config` - runs with the
+    same config share their progress log, so a rerun can resume it.
+    """
+    config_hash = hashlib.blake2b(
+        json_codec.dumps(config, default=str).encode("utf-8"), digest_size=8
+    ).hexdigest()
+    return f"{progress_dir}/{config_hash}.jsonl"
+
+
+class ProgressLog:
+    """
+    An append-only log of the results entries of a run, written (and
+    synced to disk) after each window, so an interrupted run can be
+    resumed from its last completed window.
+
+    The log starts with a `header` of the run settings that are not part
+    of its config (e.g. a randomly drawn seed). A resumed log keeps the
+    header of the run that created it.
+
+    The log is locked while it's open, so a concurrent run with the same
+    config can't overwrite it.
+    """
+
+    def __init__(
+        self,
+        log_path: str,
+        resume: bool = False,
+        header: Optional[Dict[str, Any]] = None
+    ) -> None:
+
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        self._log_path = log_path
+        self._logged = {}
+        self._header = None
+        self._file = open(log_path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            raise RuntimeError(
+                f"Progress log is used by a concurrent run: {log_path}"
+            )
+
+        if resume is True:
+            self._logged = self._load()
+        else:
+            # a new run starts a new log
+            self._file.truncate(0)
+        if self._header is None:
+            self._header = header or {}
+            self._write({"header": self._header})
+
+    @property
+    def path(self) -> str:
+        return self._log_path
+
+    @property
+    def header(self) -> Dict[str, Any]:
+        return self._header
+
+    @property
+    def logged(self) -> Dict[str, List[Tuple[str, Dict[str, List[Any]]]]]:
+        """
+        The (metric, entries) of each key that were logged by the resumed
+        run, in the order they were logged.
+        """
+        return self._logged
+
+    def append(
+        self,
+        key: str,
+        metric: str,
+        entries: Dict[str, List[Any]]
+    ) -> None:
+
+        self._write({"key": key, "metric": metric, **entries})
+
+    def close(self) -> None:
+        self._file.close()
+
+    def remove(self) -> None:
+        """
+        Removes the log once its run is completed.
+        """
+        # removed before it's unlocked, so a concurrent run doesn't open it
+        os.remove(self._log_path)
+        self._file.close()
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json_codec.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _load(self) -> Dict[str, List[Tuple[str, Dict[str, List[Any]]]]]:
+        logged = defaultdict(list)
+        num_valid_bytes = 0
+        with open(self._log_path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("missing new line")
+                    record = json_codec.loads(line)
+                except ValueError:
+                    # the last line was cut by a crash - it's dropped, so
+                    # the next records are appended after a complete line
+                    logging.warning(
+                        "Ignoring an incomplete progress log line: " +
+                        self._log_path
+                    )
+                    break
+                num_valid_bytes += len(line)
+                if "header" in record:
+                    self._header = record["header"]
+                    continue
+                logged[record.pop("key")].append(
+                    (record.pop("metric"), record)
+                )
+
+        os.truncate(self._log_path, num_valid_bytes)
+        return dict(logged)
@@ -0,0 +1,93 @@
+import common.json_codec as json_codec
+
+from typing import List, Dict, TextIO, Any
+import tempfile
+import logging
+import os
+
+
+# the results lists items are nested in root / experiments / key / list
+_ITEM_INDENT = " " * 8
+
+
+class ResultsSpill:
+    """
+    Appends the experiment results entries to a temporary .jsonl file as
+    they are generated, instead of keeping them in memory until the end of
+    the experiment.
+
+    `write` streams the spilled entries into the experiment results file,
+    in the same layout as the in-memory results dict, so the memory usage
+    doesn't grow with the number of examples.
+    """
+
+    def __init__(self, spill_dir: str) -> None:
+        os.makedirs(spill_dir, exist_ok=True)
+        fd, self._spill_path = tempfile.mkstemp(
+            dir=spill_dir, prefix=".results.", suffix=".jsonl"
+        )
+        self._file = os.fdopen(fd, "w", encoding="utf-8")
+        logging.info(f"Spilling results entries to: {self._spill_path}")
+
+    def append(self, key: str, entries: Dict[str, List[Any]]) -> None:
+        """
+        Appends the `entries` lists (e.g. model answers and scores) of a
+        window of `key` examples.
+        """
+        self._file.write(json_codec.dumps({"key": key, **entries}) + "\n")
+
+    def write(self, results: Dict[str, Any], file_path: str) -> None:
+        """
+        Writes `results` to `file_path`, where the (empty) lists of each
+        `results["experiments"]` key are filled with the spilled entries of
+        that key, and removes the spill file.
+        """
+        self._file.flush()
+        header = {
+            name: value
+            for name, value in results.items()
+            if name != "experiments"
+        }
+
+        with open(file_path, "w", encoding="utf-8") as f:
+            # the header without its closing bracket
+            f.write(json_codec.dumps(header, indent=2)[:-2])
+            f.write(',\n  "experiments": {' if header else '{\n  "experiments": {')
+            for key_idx, (key, experiment) in enumerate(
+                results["experiments"].items()
+            ):
+                f.write("," if key_idx else "")
+                f.write(f"\n    {json_codec.dumps(key)}: {{")
+                for field_idx, (field, value) in enumerate(experiment.items()):
+                    f.write("," if field_idx else "")
+                    f.write(f"\n      {json_codec.dumps(field)}: ")
+                    if isinstance(value, list):
+                        self._write_list(f, key, field)
+                    else:
+                        f.write(json_codec.dumps(value))
+                f.write("\n    }")
+            f.write("\n  }\n}\n")
+
+        self.close()
+        os.remove(self._spill_path)
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+    def _write_list(self, f: TextIO, key: str, field: str) -> None:
+        decode = json_codec.get_fields_decoder(["key", field])
+        num_items = 0
+        with open(self._spill_path, encoding="utf-8") as spill:
+            for line in spill:
+                entry = decode(line)
+                if entry["key"] != key:
+                    continue
+                for item in entry[field] or []:
+                    encoded = json_codec.dumps(item, indent=2).replace(
+                        "\n", "\n" + _ITEM_INDENT
+                    )
+                    f.write(f",\n{_ITEM_INDENT}" if num_items else "[\n" + _ITEM_INDENT)
+                    f.write(encoded)
+                    num_items += 1
+        f.write("\n      ]" if num_items else "[]")
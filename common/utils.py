@@ -1,4 +1,5 @@
 from typing import List, Dict, Optional
+import hashlib
 
 
 def get_messages_list(
@@ -11,3 +12,14 @@ def get_messages_list(
         messages.append({"role": "system", "content": system})
     messages.append({"role": "user", "content": user})
     return messages
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the blake2b hex digest of the `file_path` content.
+    """
+    hasher = hashlib.blake2b()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            hasher.update(chunk)
+    return hasher.hexdigest()
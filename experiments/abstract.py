@@ -1,13 +1,24 @@
 from tests.mocks.vllm_wrapper import vLLMWrapperMock
+from src.token_length_index import TokenLengthIndex, get_index_path
 from src.prompt_builder import PromptBuilder
-from common.entities import ExperimentType, PromptingMode
+import src.prefix_scheduler as prefix_scheduler
+from common.entities import (
+    ExperimentType, PromptingMode, Document, DocumentTable, TokenizedPrompt
+)
 from src.wrappers import HfTokenizer, vLLMWrapper
+from common.progress_log import ProgressLog, get_progress_log_path
+from common.results_spill import ResultsSpill
+import common.nq_shuffle as nq_shuffle
 from src.metrics import best_subspan_em
+import common.json_codec as json_codec
 import common.consts as consts
 
 from argparse import Namespace
 from datetime import datetime, UTC
-from typing import List, Dict, Union, Optional, Tuple, Any
+from typing import (
+    List, Dict, Union, Optional, Tuple, Sequence, Iterator, Any
+)
+from itertools import islice
 from abc import ABC
 import logging
 import torch
@@ -17,8 +28,24 @@ import os
 
 class AbstractExperiment(ABC):
     _TYPE = None
-
-    def __init__(self, args: Namespace) -> None:
+    # the arguments that change the results of a run - runs that differ
+    # only by the other (performance) arguments share their progress log
+    _RESULTS_ARGS = [
+        "experiment", "model", "prompting_mode", "num_docs", "gold_idx",
+        "dtype", "temperature", "top_p", "max_tokens", "max_model_len",
+        "test_mode", "seed", "max_examples", "token_budget"
+    ]
+
+    def __init__(
+        self,
+        args: Namespace,
+        tokenizer: Optional[HfTokenizer] = None,
+        llm: Optional[Union[vLLMWrapper, vLLMWrapperMock]] = None
+    ) -> None:
+        """
+        `tokenizer` and `llm` are loaded from `args` if not set - a sweep
+        passes the ones loaded by its first experiment to the next ones.
+        """
         if torch.cuda.is_available():
             msg = f"HW type: GPU | HW name: {torch.cuda.get_device_name(0)}"
         else:
@@ -31,16 +58,56 @@ class AbstractExperiment(ABC):
         )
 
         self._prompting_mode = PromptingMode(args.prompting_mode)
-        self._tokenizer = HfTokenizer(args.model)
+        self._tokenizer = tokenizer or HfTokenizer(
+            model=args.model,
+            token_count_cache_path=args.token_count_cache
+        )
         self._prompt_builder = PromptBuilder(
             prompting_mode=self._prompting_mode,
             tokenizer=self._tokenizer
         )
 
-        self._llm = self._load_llm(args)
+        # when set, prompts are fitted into `token_budget` tokens
+        self._token_budget = args.token_budget
+        self._verify_token_length_index = args.verify_token_lengths
+        # when set, all prompts are generated at once, by their prefix order
+        self._prefix_scheduling = args.prefix_scheduling
+        # when set, predictions are streamed and scored as they finish
+        self._async_engine = args.async_engine
+        self._token_length_index = self._get_token_length_index(args)
+
+        self._llm = llm or self._load_llm(args)
         self._sampling_params = self._get_llm_sampling_params(args)
 
         self._results_dir = args.results_dir or consts.RESULTS_DIR
+        # when set, data files are read lazily and each key is processed in
+        # windows of `stream_window` examples instead of all at once
+        self._stream_window = args.stream_window
+        self._max_examples = self._get_max_examples(args)
+        # when set, results entries are appended to disk after each window
+        # instead of being kept in memory until the experiment ends
+        self._results_spill = None
+        if args.flush_results is True:
+            self._results_spill = ResultsSpill(self._results_dir)
+            if self._stream_window is None:
+                logging.warning(
+                    "Argument flush_results=True without a stream_window - " +
+                    "the data and prompts are still fully loaded in memory."
+                )
+        # when set, the results entries of each window are logged, so an
+        # interrupted run can be resumed (see `_resume`)
+        self._resume = args.resume
+        self._progress_log = None
+        if args.log_progress is True or args.resume is True:
+            self._progress_log = self._get_progress_log(args)
+        # the seed of the openbook_random documents order - a resumed run
+        # keeps the seed of the run it resumes
+        self._seed = args.seed
+        if self._progress_log is not None:
+            self._seed = self._progress_log.header.get("seed", args.seed)
+        # number of examples of each key that were completed by the
+        # resumed run
+        self._num_completed_examples: Dict[str, int] = {}
         self._data = None
         self._results = None
 
@@ -48,30 +115,199 @@ class AbstractExperiment(ABC):
     def results(self) -> Dict[str, Any]:
         return self._results
 
+    @property
+    def tokenizer(self) -> HfTokenizer:
+        return self._tokenizer
+
+    @property
+    def llm(self) -> Union[vLLMWrapper, vLLMWrapperMock]:
+        return self._llm
+
     @classmethod
     def get_type(cls) -> ExperimentType:
         return cls._TYPE
 
     def run(self) -> None:
         logging.info(f"Running a {self._TYPE.value} experiment...")
-        for key in self._data.keys():
-            logging.info(f"Starting process '{key}'...")
+        # the llm may have generated the prompts of a previous experiment
+        self._llm.reset_stats()
+        if self._resume is True:
+            self._restore_progress()
 
-            prompts = self._get_prompts_by_data_key(key)
-            predictions = self._llm.generate_batch(
-                prompts, **self._sampling_params
-            )
-            metric, scores = self._calc_predictions_scores(predictions, key)
+        windows = self._iter_prompt_windows()
+        for (key, prompts, _, dropped_documents), predictions, metric, scores in \
+                self._iter_window_results(windows):
 
             self._add_new_result_entries(
                 prompts=prompts,
                 model_answers=predictions,
                 scores=scores,
                 metric=metric,
-                key=key
+                key=key,
+                dropped_documents=dropped_documents
             )
 
+        if self._token_length_index is not None:
+            self._token_length_index.save()
+        if self._llm.generation_cache_stats is not None:
+            logging.info(
+                f"Generation cache stats: {self._llm.generation_cache_stats}"
+            )
+            self._results["generation_cache"] = self._llm.generation_cache_stats
         self._log_experiment_results()
+        if self._progress_log is not None:
+            # the run is completed - there's nothing left to resume
+            self._progress_log.remove()
+
+    def _iter_prompt_windows(
+        self
+    ) -> Iterator[
+        Tuple[str, List[TokenizedPrompt], List[List[str]], Optional[List[List[int]]]]
+    ]:
+        """
+        Yields the (key, prompts, answers, dropped documents) of each data
+        window of each key (see `_iter_data_windows`).
+        """
+        for key in self._data.keys():
+            logging.info(f"Starting process '{key}'...")
+
+            # set when the documents lists hold interned documents indices
+            document_table = self._data[key].get("document_table")
+            for questions, answers_list, documents_list, permutations in \
+                    self._iter_data_windows(key):
+
+                dropped_documents = None
+                if self._token_budget is not None and documents_list is not None:
+                    documents_list, permutations, dropped_documents = \
+                        self._prompt_builder.fit_documents(
+                            questions,
+                            documents_list,
+                            self._token_budget,
+                            self._token_length_index,
+                            document_table,
+                            permutations
+                        )
+
+                prompts = self._get_prompts(
+                    questions, documents_list, document_table, permutations
+                )
+                if self._verify_token_length_index is True:
+                    self._verify_token_lengths(
+                        prompts, questions, documents_list, document_table
+                    )
+                yield key, prompts, answers_list, dropped_documents
+
+    def _iter_window_results(
+        self,
+        windows: Iterator[Tuple[str, List[TokenizedPrompt], Any, Any]]
+    ) -> Iterator[
+        Tuple[Tuple[str, List[TokenizedPrompt], Any, Any], List[str], str, List[float]]
+    ]:
+        """
+        Yields each of `windows` with the predictions of its prompts, their
+        metric and scores.
+
+        The windows are generated in batches - each window on its own, or
+        with prefix scheduling, the prompts of all windows (of all keys) in
+        a single batch, ordered by their shared prefixes.
+
+        On async engine mode the predictions are scored as they finish, and
+        the next batch is submitted before the current one is consumed, so
+        the tail of a batch doesn't stall the llm.
+        """
+        if self._prefix_scheduling is True:
+            batches = iter([list(windows)])
+        else:
+            batches = ([window] for window in windows)
+
+        pending = None
+        for batch in batches:
+            submitted = batch, self._submit_batch(batch)
+            if self._async_engine is not True:
+                yield from self._collect_batch(*submitted)
+                continue
+            if pending is not None:
+                yield from self._collect_batch(*pending)
+            pending = submitted
+
+        if pending is not None:
+            yield from self._collect_batch(*pending)
+
+    def _submit_batch(
+        self,
+        batch: List[Tuple[str, List[TokenizedPrompt], Any, Any]]
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Submits the prompts of `batch` windows to the llm and returns an
+        iterator over their (prompt index in the batch, prediction) pairs.
+        """
+        prompts = [
+            prompt
+            for _, window_prompts, _, _ in batch
+            for prompt in window_prompts
+        ]
+        order = list(range(len(prompts)))
+        if self._prefix_scheduling is True:
+            order = prefix_scheduler.get_prefix_order(prompts)
+            prompts = [prompts[idx] for idx in order]
+            shared_prefix_ratio = prefix_scheduler.get_shared_prefix_ratio(
+                prompts
+            )
+            logging.info(
+                f"Generating {len(prompts)} prompts by prefix order " +
+                f"(shared prefix ratio: {shared_prefix_ratio:.3f})"
+            )
+            self._results["prefix_caching"] = {
+                "shared_prefix_ratio": shared_prefix_ratio,
+                "hit_ratio": None
+            }
+
+        if self._async_engine is True:
+            # the predictions are streamed in the order they finish
+            predictions = self._llm.generate_stream(
+                prompts, **self._sampling_params
+            )
+        else:
+            predictions = enumerate(
+                self._llm.generate_batch(prompts, **self._sampling_params)
+            )
+        return ((order[idx], prediction) for idx, prediction in predictions)
+
+    def _collect_batch(
+        self,
+        batch: List[Tuple[str, List[TokenizedPrompt], Any, Any]],
+        predictions: Iterator[Tuple[int, str]]
+    ) -> Iterator[
+        Tuple[Tuple[str, List[TokenizedPrompt], Any, Any], List[str], str, List[float]]
+    ]:
+
+        answers_list = [
+            answers
+            for _, _, window_answers_list, _ in batch
+            for answers in window_answers_list
+        ]
+        batch_predictions = [None] * len(answers_list)
+        scores = [None] * len(answers_list)
+        metric = None
+        for idx, prediction in predictions:
+            # each prediction is scored as soon as it's generated
+            metric, (scores[idx],) = self._calc_predictions_scores(
+                [prediction], [answers_list[idx]]
+            )
+            batch_predictions[idx] = prediction
+
+        if self._prefix_scheduling is True:
+            # None if the llm doesn't report its prefix cache hits
+            prefix_cache_hit_ratio = self._llm.prefix_cache_hit_ratio
+            logging.info(f"Prefix cache hit ratio: {prefix_cache_hit_ratio}")
+            self._results["prefix_caching"]["hit_ratio"] = prefix_cache_hit_ratio
+
+        start = 0
+        for window in batch:
+            _, prompts, _, _ = window
+            end = start + len(prompts)
+            yield window, batch_predictions[start:end], metric, scores[start:end]
+            start = end
 
     def _load_llm(
         self,
@@ -83,7 +319,10 @@ class AbstractExperiment(ABC):
             "dtype": args.dtype,
             "num_gpus": args.num_gpus,
             "max_model_len": args.max_model_len,
-            "gpu_memory_utilization": args.gpu_memory_utilization
+            "gpu_memory_utilization": args.gpu_memory_utilization,
+            "enable_prefix_caching": args.enable_prefix_caching,
+            "async_engine": args.async_engine,
+            "generation_cache_path": args.generation_cache
         }
 
         if args.test_mode is True:
@@ -91,26 +330,131 @@ class AbstractExperiment(ABC):
             return vLLMWrapperMock(**vllm_payload)
         return vLLMWrapper(**vllm_payload)
 
+    def _get_token_length_index(
+        self,
+        args: Namespace
+    ) -> Optional[TokenLengthIndex]:
+
+        if args.verify_token_lengths is True:
+            logging.info(
+                "Argument verify_token_lengths=True. " +
+                "Verifying the token length index counts."
+            )
+        elif args.token_budget is None:
+            return None
+
+        return TokenLengthIndex(
+            prompt_builder=self._prompt_builder,
+            tokenizer=self._tokenizer,
+            index_path=get_index_path(consts.TOKEN_LENGTHS_DIR, args.model)
+        )
+
+    def _verify_token_lengths(
+        self,
+        prompts: List[TokenizedPrompt],
+        questions: List[str],
+        documents_list: Optional[List[List[Document]]] = None,
+        document_table: Optional[DocumentTable] = None
+    ) -> None:
+
+        num_exact, max_error = self._token_length_index.verify(
+            prompts, questions, documents_list, document_table
+        )
+        msg = f"Token length index: {num_exact}/{len(prompts)} exact counts " + \
+            f"(max error: {max_error} tokens)"
+        if num_exact == len(prompts):
+            logging.info(msg)
+        else:
+            logging.warning(msg)
+
+    def _get_max_examples(self, args: Namespace) -> Optional[int]:
+        # data files are read only up to the returned number of examples
+        max_examples = args.max_examples
+        if args.test_mode is True:
+            n = consts.TEST_NUM_EXAMPLES
+            logging.info(f"Argument test_mode=True. Reading only {n} examples.")
+            max_examples = n if max_examples is None else min(max_examples, n)
+        return max_examples
+
     def _add_new_result_entries(
         self,
-        prompts: List[str],
+        prompts: List[TokenizedPrompt],
         model_answers: List[str],
         scores: List[float],
         metric: str,
-        key: str
+        key: str,
+        dropped_documents: Optional[List[List[int]]] = None
     ) -> None:
 
-        num_prompt_tokens_list = [
-            self._tokenizer.count_tokens(
-                prompt=prompt, prompt_with_inst_tokens=True
-            ) for prompt in prompts
-        ]
+        entries = {
+            "model_answers": model_answers,
+            "scores": scores,
+            "num_prompt_tokens": [prompt.num_tokens for prompt in prompts]
+        }
+        if "dropped_documents" in self._results["experiments"][key]:
+            # closedbook prompts have no documents to drop
+            entries["dropped_documents"] = \
+                dropped_documents or [[] for _ in prompts]
+
+        if self._progress_log is not None:
+            self._progress_log.append(key, metric, entries)
+        self._record_result_entries(key, metric, entries)
+
+    def _record_result_entries(
+        self,
+        key: str,
+        metric: str,
+        entries: Dict[str, List[Any]]
+    ) -> None:
 
         experiment = self._results["experiments"][key]
-        experiment["model_answers"].extend(model_answers)
-        experiment["scores"].extend(scores)
         experiment["metric"] = metric
-        experiment["num_prompt_tokens"].extend(num_prompt_tokens_list)
+        if self._results_spill is not None:
+            self._results_spill.append(key, entries)
+            return
+        for name, values in entries.items():
+            experiment[name].extend(values)
+
+    def _get_progress_log(self, args: Namespace) -> ProgressLog:
+        config = {name: getattr(args, name) for name in self._RESULTS_ARGS}
+        log_path = get_progress_log_path(
+            f"{self._results_dir}/.progress", config
+        )
+        if args.resume is True:
+            logging.info(f"Argument resume=True. Resuming from: {log_path}")
+
+        seed = args.seed
+        if self._prompting_mode is PromptingMode.OPENBOOK_RANDOM:
+            # an unseeded run draws its seed up front, so a resumed run
+            # orders the documents the same way
+            seed = nq_shuffle.get_seed(seed)
+        return ProgressLog(log_path, resume=args.resume, header={"seed": seed})
+
+    def _restore_progress(self) -> None:
+        """
+        Restores the results entries that were logged by the resumed run,
+        so only the rest of the examples of each key are generated.
+        """
+        for key, logged_entries in self._progress_log.logged.items():
+            if key not in self._results["experiments"]:
+                continue
+            for metric, entries in logged_entries:
+                self._record_result_entries(key, metric, entries)
+                self._num_completed_examples[key] = \
+                    self._num_completed_examples.get(key, 0) + \
+                    len(entries["model_answers"])
+            logging.info(
+                f"Restored {self._num_completed_examples[key]} completed " +
+                f"examples of '{key}'"
+            )
+
+    def _write_results(self, result_file_path: str) -> None:
+        if self._results_spill is not None:
+            self._results_spill.write(self._results, result_file_path)
+            return
+
+        with open(result_file_path, "w", encoding="utf-8") as f:
+            f.write(json_codec.dumps(self._results, indent=2) + "\n")
 
     def _create_process_dirs(self, dirs: List[str]) -> None:
         for dir in dirs:
@@ -123,67 +467,90 @@ class AbstractExperiment(ABC):
             "top_p": args.top_p
         }
 
-    def _get_prompts_by_data_key(self, key: str) -> List[str]:
-        questions = self._data[key]["questions"]
-
-        if self._prompting_mode is not PromptingMode.CLOSEDBOOK:
-            documents_list = self._data[key]["documents"]
-            return [
-                self._prompt_builder.build(question, documents)
-                for question, documents in zip(questions, documents_list)
-            ]
-        return [
-            self._prompt_builder.build(question)
-            for question in questions
+    def _iter_data_windows(
+        self,
+        key: str
+    ) -> Iterator[
+        Tuple[
+            List[str],
+            List[List[str]],
+            Optional[List[List[Document]]],
+            Optional[List[Sequence[int]]]
         ]
+    ]:
+        """
+        Yields the `key` examples as (questions, answers, documents,
+        permutations) windows of `stream_window` examples. Without a
+        `stream_window` the entire key is yielded as a single window.
+
+        On closedbook mode the yielded documents are None. The permutations
+        are None unless the key holds openbook_random documents that are
+        not ordered yet.
+
+        The examples that were completed by a resumed run are skipped.
+        """
+        examples = islice(
+            self._iter_examples_by_data_key(key),
+            self._num_completed_examples.get(key, 0),
+            None
+        )
+        while window := list(islice(examples, self._stream_window)):
+            questions, answers_list, documents_list, permutations = \
+                map(list, zip(*window))
+            if self._prompting_mode is PromptingMode.CLOSEDBOOK:
+                documents_list = None
+            if all(permutation is None for permutation in permutations):
+                permutations = None
+            yield questions, answers_list, documents_list, permutations
+
+    def _iter_examples_by_data_key(
+        self,
+        key: str
+    ) -> Iterator[
+        Tuple[str, List[str], Optional[List[Document]], Optional[Sequence[int]]]
+    ]:
+
+        entry = self._data[key]
+        if "stream" in entry:
+            yield from entry["stream"]()
+            return
+
+        questions = entry["questions"]
+        answers_list = entry["answers"]
+        documents_list = entry.get("documents") or [None] * len(questions)
+        permutations = entry.get("permutations") or [None] * len(questions)
+        yield from zip(questions, answers_list, documents_list, permutations)
+
+    def _get_prompts(
+        self,
+        questions: List[str],
+        documents_list: Optional[List[List[Document]]] = None,
+        document_table: Optional[DocumentTable] = None,
+        permutations: Optional[List[Sequence[int]]] = None
+    ) -> List[TokenizedPrompt]:
+
+        # prompts are tokenized once - the token ids are passed to the llm
+        # and their lengths are reported as the num_prompt_tokens
+        return self._prompt_builder.build_many(
+            questions,
+            documents_list,
+            document_table,
+            permutations,
+            tokenize=True
+        )
 
     def _calc_predictions_scores(
         self,
         predictions: List[str],
-        key: str
+        answers_list: List[List[str]]
     ) -> Tuple[str, List[float]]:
 
-        answers_list = self._data[key]["answers"]
         scores = [
             best_subspan_em(prediction=prediction, ground_truths=answers)
             for prediction, answers in zip(predictions, answers_list)
         ]
         return "best_subspan_em", scores
 
-    def _truncate_data(
-        self,
-        n: Optional[int] = 1,
-        in_place: Optional[bool] = True
-    ) -> Optional[Dict[str, Any]]:
-        """
-        Truncates each of the 'questions', 'answers', and 'documents' lists in the dataset
-        to the first `n` elements.
-
-        Args:
-            data_dict (dict): The original dataset.
-            n (int): The number of examples to keep in each list.
-            in_place (bool): If True, modifies the original dict. If False, returns a new truncated dict.
-
-        Returns:
-            dict: The truncated dataset (only if in_place=False).
-        """
-        target = self._data if in_place is True else {}
-
-        for key, entry in self._data.items():
-            if in_place is True:
-                entry["questions"] = entry["questions"][:n]
-                entry["answers"] = entry["answers"][:n]
-                entry["documents"] = entry["documents"][:n]
-            else:
-                target[key] = {
-                    "questions": entry["questions"][:n],
-                    "answers": entry["answers"][:n],
-                    "documents": entry["documents"][:n]
-                }
-
-        if in_place is False:
-            return target
-
     def _get_empty_results_dict(self, args: Namespace) -> None:
         results = {
             "model": args.model,
@@ -199,6 +566,9 @@ class AbstractExperiment(ABC):
         else:
             raise ValueError("Unrecognized ExperimentType")
 
+        if self._token_budget is not None:
+            results.update({"token_budget": self._token_budget})
+
         experiments = {}
         for key in self._data.keys():
             experiments.update({
@@ -210,6 +580,10 @@ class AbstractExperiment(ABC):
                     "num_prompt_tokens": []
                 }
             })
+            if self._token_budget is not None:
+                # the indices of the documents dropped from each prompt
+                # to fit the token budget
+                experiments[key]["dropped_documents"] = []
 
         results.update({"experiments": experiments})
         return results
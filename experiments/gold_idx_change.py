@@ -1,37 +1,53 @@
+from tests.mocks.vllm_wrapper import vLLMWrapperMock
 from experiments.abstract import AbstractExperiment
+from src.wrappers import HfTokenizer, vLLMWrapper
 from common.entities import ExperimentType, PromptingMode
 from argparse import Namespace
 import common.nq_data as nq_data
 import common.consts as consts
 
 from datetime import datetime, UTC
+from typing import Optional, Union
 import logging
-import json
 import os
 
 
 class GoldIdxChange(AbstractExperiment):
     _TYPE = ExperimentType.GOLD_IDX_CHANGE
 
-    def __init__(self, args: Namespace) -> None:
-        super().__init__(args)
+    def __init__(
+        self,
+        args: Namespace,
+        tokenizer: Optional[HfTokenizer] = None,
+        llm: Optional[Union[vLLMWrapper, vLLMWrapperMock]] = None
+    ) -> None:
+        super().__init__(args, tokenizer, llm)
         
-        created_folder = nq_data.download_files_by_num_docs(
-            src_dir=consts.DATA_SRC_DIR,
-            dst_dir=consts.DATA_DST_DIR,
-            num_docs=args.num_docs
-        )
+        if args.read_compressed is True:
+            # reading the .jsonl.gz files directly, without extracting them
+            data_folder = nq_data.get_src_folder_by_num_docs(
+                src_dir=consts.DATA_SRC_DIR,
+                num_docs=args.num_docs
+            )
+        else:
+            data_folder = nq_data.download_files_by_num_docs(
+                src_dir=consts.DATA_SRC_DIR,
+                dst_dir=consts.DATA_DST_DIR,
+                num_docs=args.num_docs,
+                num_workers=args.num_workers
+            )
 
         self._data = nq_data.read_files_by_num_docs(
-            folder_path=created_folder,
-            prompting_mode=self._prompting_mode
+            folder_path=data_folder,
+            prompting_mode=self._prompting_mode,
+            stream=self._stream_window is not None,
+            num_workers=args.num_workers,
+            seed=self._seed,
+            cache_dir=args.data_cache_dir,
+            intern_documents=args.intern_documents,
+            max_examples=self._max_examples
         )
 
-        if args.test_mode is True:
-            n = consts.TEST_NUM_EXAMPLES
-            logging.info(f"Argument test_mode=True. Truncating data to {n}.")
-            self._truncate_data(n)
-
         self._results = self._get_empty_results_dict(args)
 
     def _log_experiment_results(self) -> None:
@@ -55,7 +71,6 @@ class GoldIdxChange(AbstractExperiment):
 
         os.makedirs(result_file_dir, exist_ok=True)
         result_file_path = f"{result_file_dir}/{timestamp}.json"
-        with open(result_file_path, "w") as f:
-            f.write(json.dumps(self._results, indent=2) + "\n")
+        self._write_results(result_file_path)
 
         logging.info(f"Results saved to {result_file_path}")
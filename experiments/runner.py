@@ -1,11 +1,13 @@
 from common.env_utils.arg_setting import set_hf_token
 from experiments.abstract import AbstractExperiment
-from common.entities import ExperimentType
+from common.entities import ExperimentType, PromptingMode
 from experiments import ALL_EXPERIMENTS
 import common.consts as consts
 
 from argparse import Namespace
-from typing import Type, Optional
+from typing import Type, Optional, List
+from itertools import product
+import logging
 
 
 def run(
@@ -19,6 +21,81 @@ def run(
     experiment.run()
 
 
+def is_sweep(args: Namespace) -> bool:
+    return any(
+        getattr(args, name) is not None
+        for name in [
+            "sweep_experiments", "sweep_prompting_modes",
+            "sweep_num_docs", "sweep_gold_idxs"
+        ]
+    )
+
+
+def run_sweep(args: Namespace) -> None:
+    """
+    Runs an experiment for each config of the sweep grid (see
+    `get_sweep_configs`). The tokenizer and the llm are loaded once, by
+    the first experiment, and shared by all the others.
+    """
+    set_hf_token(args.hf_token)
+    configs = get_sweep_configs(args)
+    tokenizer, llm = None, None
+    for config_idx, config_args in enumerate(configs):
+        logging.info(
+            f"Running sweep config {config_idx + 1}/{len(configs)}: " +
+            f"experiment={config_args.experiment}, " +
+            f"prompting_mode={config_args.prompting_mode}, " +
+            f"num_docs={config_args.num_docs}, " +
+            f"gold_idx={config_args.gold_idx}"
+        )
+        experiment_cls = _get_experiment_class(config_args)
+        experiment = experiment_cls(config_args, tokenizer=tokenizer, llm=llm)
+        experiment.run()
+        # only the loaded models are kept - the experiment data is released
+        # before the next config reads its own
+        tokenizer, llm = experiment.tokenizer, experiment.llm
+        del experiment
+
+
+def get_sweep_configs(args: Namespace) -> List[Namespace]:
+    """
+    Returns the args of each config of the grid of the `sweep_*` args -
+    the grid dimensions that are not set take their single (non sweep) arg
+    value. The num_docs only vary the gold_idx_change experiments, and the
+    gold_idx only vary the num_docs_change ones, so the configs that differ
+    only by an unused dimension are run once.
+    """
+    grid = product(
+        args.sweep_experiments or [args.experiment],
+        args.sweep_prompting_modes or [args.prompting_mode],
+        args.sweep_num_docs or [args.num_docs],
+        args.sweep_gold_idxs or [args.gold_idx]
+    )
+
+    configs = []
+    seen = set()
+    for experiment, prompting_mode, num_docs, gold_idx in grid:
+        experiment_type = ExperimentType(experiment)
+        prompting_mode = PromptingMode(prompting_mode)
+        if experiment_type is ExperimentType.GOLD_IDX_CHANGE:
+            gold_idx = args.gold_idx
+        elif experiment_type is ExperimentType.NUM_DOCS_CHANGE:
+            num_docs = args.num_docs
+
+        config = (experiment_type, prompting_mode, num_docs, gold_idx)
+        if config in seen:
+            continue
+        seen.add(config)
+        configs.append(Namespace(**{
+            **vars(args),
+            "experiment": experiment_type.value,
+            "prompting_mode": prompting_mode.value,
+            "num_docs": num_docs,
+            "gold_idx": gold_idx
+        }))
+    return configs
+
+
 def _get_experiment_class(args: Namespace) -> Type[AbstractExperiment]:
     try:
         experiment_type = ExperimentType(args.experiment)
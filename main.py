@@ -12,7 +12,10 @@ if __name__ == "__main__":
     try:
         configure_log()
         args = read_cli_env_args()
-        experiment_runner.run(args)
+        if experiment_runner.is_sweep(args):
+            experiment_runner.run_sweep(args)
+        else:
+            experiment_runner.run(args)
 
     except KeyboardInterrupt:
         sys.exit(130)
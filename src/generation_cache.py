@@ -0,0 +1,196 @@
+from common.entities import TokenizedPrompt
+import common.json_codec as json_codec
+
+from typing import List, Dict, Union, Optional, Callable, Any
+import sqlite3
+import hashlib
+import logging
+import time
+import os
+
+
+# sqlite limits the number of query parameters
+_QUERY_CHUNK_SIZE = 500
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class GenerationCache:
+    """
+    A disk backed (SQLite) cache of llm completions, so reruns of the same
+    prompts (e.g. the closedbook baselines of every experiment) don't
+    generate them again.
+
+    The completions are keyed by a hash of the model, its dtype, the
+    sampling params and the prompt. Note that on sampling (temperature >
+    0) a cached completion is the one sampled by the first run.
+
+    The cache holds at most `max_entries` completions - the least recently
+    used ones are evicted first, and completions older than `max_age_days`
+    are evicted when the cache is opened.
+    """
+
+    def __init__(
+        self,
+        cache_path: str,
+        model: str,
+        dtype: str,
+        max_entries: int,
+        max_age_days: float
+    ) -> None:
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._model_id = f"{model}\0{dtype}"
+        self._max_entries = max_entries
+        self._num_hits = 0
+        self._num_misses = 0
+        # the cache may be shared by concurrent experiments
+        self._connection = sqlite3.connect(cache_path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions (" +
+            "key INTEGER PRIMARY KEY, " +
+            "completion TEXT NOT NULL, " +
+            "created INTEGER NOT NULL, " +
+            "last_used INTEGER NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_used " +
+            "ON completions (last_used)"
+        )
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM completions WHERE created < ?",
+                (time.time_ns() - int(max_age_days * _SECONDS_PER_DAY * 1e9),)
+            )
+        # an upper bound of the number of cached completions, so the table
+        # is only counted when it may exceed `max_entries`
+        self._num_entries = self._count_entries()
+        logging.info(f"Using generation cache: {cache_path}")
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self._num_hits, "misses": self._num_misses}
+
+    def reset_stats(self) -> None:
+        self._num_hits = 0
+        self._num_misses = 0
+
+    def get_many(
+        self,
+        prompts: List[Union[str, TokenizedPrompt]],
+        sampling_params: Dict[str, Any]
+    ) -> List[Optional[str]]:
+        """
+        Returns the cached completion of each of `prompts`, or None for the
+        prompts that are not cached.
+        """
+        keys = self._get_keys(prompts, sampling_params)
+        completions = {}
+        for start in range(0, len(keys), _QUERY_CHUNK_SIZE):
+            chunk = keys[start:start + _QUERY_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            completions.update(self._connection.execute(
+                "SELECT key, completion FROM completions " +
+                f"WHERE key IN ({placeholders})",
+                chunk
+            ))
+
+        if completions:
+            with self._connection:
+                self._connection.executemany(
+                    "UPDATE completions SET last_used = ? WHERE key = ?",
+                    [(time.time_ns(), key) for key in completions]
+                )
+        self._num_hits += sum(key in completions for key in keys)
+        self._num_misses += sum(key not in completions for key in keys)
+        return [completions.get(key) for key in keys]
+
+    def put_many(
+        self,
+        prompts: List[Union[str, TokenizedPrompt]],
+        completions: List[str],
+        sampling_params: Dict[str, Any]
+    ) -> None:
+        """
+        Caches the completions of `prompts`, evicting the least recently
+        used completions beyond `max_entries`.
+        """
+        now = time.time_ns()
+        keys = self._get_keys(prompts, sampling_params)
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                [
+                    (key, completion, now, now)
+                    for key, completion in zip(keys, completions)
+                ]
+            )
+            # the running count may include replaced completions, so the
+            # table is recounted before evicting
+            self._num_entries += len(keys)
+            if self._num_entries > self._max_entries:
+                self._num_entries = self._count_entries()
+            if self._num_entries > self._max_entries:
+                self._connection.execute(
+                    "DELETE FROM completions WHERE key IN (" +
+                    "SELECT key FROM completions ORDER BY last_used LIMIT ?)",
+                    (self._num_entries - self._max_entries,)
+                )
+                self._num_entries = self._max_entries
+
+    def generate(
+        self,
+        prompts: List[Union[str, TokenizedPrompt]],
+        sampling_params: Dict[str, Any],
+        generate_batch: Callable[[List[Union[str, TokenizedPrompt]]], List[str]]
+    ) -> List[str]:
+        """
+        Returns the completions of `prompts` - the cached ones, and the
+        ones `generate_batch` generates (and caches) for the rest.
+        """
+        completions = self.get_many(prompts, sampling_params)
+        missing_idxs = [
+            idx for idx, completion in enumerate(completions)
+            if completion is None
+        ]
+        if missing_idxs:
+            missing_prompts = [prompts[idx] for idx in missing_idxs]
+            missing_completions = generate_batch(missing_prompts)
+            self.put_many(missing_prompts, missing_completions, sampling_params)
+            for idx, completion in zip(missing_idxs, missing_completions):
+                completions[idx] = completion
+        return completions
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _count_entries(self) -> int:
+        (num_entries,) = self._connection.execute(
+            "SELECT COUNT(*) FROM completions"
+        ).fetchone()
+        return num_entries
+
+    def _get_keys(
+        self,
+        prompts: List[Union[str, TokenizedPrompt]],
+        sampling_params: Dict[str, Any]
+    ) -> List[int]:
+
+        sampling_params = dict(sorted(sampling_params.items()))
+        prefix = f"{self._model_id}\0{json_codec.dumps(sampling_params)}\0"
+        return [
+            _get_key(
+                prefix +
+                (prompt.text if isinstance(prompt, TokenizedPrompt) else prompt)
+            )
+            for prompt in prompts
+        ]
+
+
+def _get_key(value: str) -> int:
+    # a 64 bit key - sqlite integer primary keys are signed
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
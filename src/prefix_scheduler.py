@@ -0,0 +1,46 @@
+from common.entities import TokenizedPrompt
+
+from typing import List
+import numpy as np
+
+
+def get_prefix_order(prompts: List[TokenizedPrompt]) -> List[int]:
+    """
+    Returns the order (indices of `prompts`) to submit `prompts` in, so
+    prompts that share a prefix are submitted next to each other and the
+    llm prefix cache can reuse it.
+
+    Sorting the token ids lexicographically visits the prompts in the
+    (depth first) order of a trie over their token ids, without building
+    the trie - every group of prompts that share a prefix is contiguous.
+    """
+    return sorted(range(len(prompts)), key=lambda idx: prompts[idx].token_ids)
+
+
+def get_shared_prefix_ratio(prompts: List[TokenizedPrompt]) -> float:
+    """
+    Returns the fraction of `prompts` tokens that are a prefix shared with
+    the previous prompt in submission order - the prefix cache hit ratio
+    `prompts` can reach (it's an upper bound, as the llm caches whole
+    blocks of tokens and may evict them).
+    """
+    num_tokens = sum(len(prompt.token_ids) for prompt in prompts)
+    if num_tokens == 0:
+        return 0.0
+
+    num_shared_tokens = 0
+    previous_token_ids = None
+    for prompt in prompts:
+        token_ids = np.asarray(prompt.token_ids)
+        if previous_token_ids is not None:
+            num_shared_tokens += _get_common_prefix_length(
+                previous_token_ids, token_ids
+            )
+        previous_token_ids = token_ids
+    return num_shared_tokens / num_tokens
+
+
+def _get_common_prefix_length(a: np.ndarray, b: np.ndarray) -> int:
+    length = min(len(a), len(b))
+    mismatches = np.flatnonzero(a[:length] != b[:length])
+    return int(mismatches[0]) if len(mismatches) else length
@@ -1,12 +1,30 @@
-from common.entities import Document, PromptingMode
+from common.entities import (
+    Document, DocumentTable, PromptingMode, TokenizedPrompt
+)
 from common.utils import get_messages_list
 from src.wrappers import HfTokenizer
 
-from typing import List, Tuple, Optional
+from typing import (
+    List, Tuple, Sequence, Union, Optional, TYPE_CHECKING
+)
+import logging
+
+if TYPE_CHECKING:
+    # the index calibrates its counts with a prompt builder
+    from src.token_length_index import TokenLengthIndex
 
 
 class PromptBuilder:
 
+    # placeholder user content used to split the rendered chat template
+    _CHAT_TEMPLATE_SENTINEL = "@@PROMPT_BUILDER_USER_CONTENT@@"
+    # user contents that a spliced prompt must reproduce exactly (the
+    # chat template may not escape, strip or branch on the user content)
+    _CHAT_TEMPLATE_PROBES = [
+        "Search Results:\nDocument [1](Title: <a> & \"b\") {c}\n\nAnswer:",
+        "Question: x\n\nAnswer:"
+    ]
+
     _TEMPLATE_MAPPING = {
         PromptingMode.OPENBOOK: {
             "system": "Write a high-quality answer for the given question using only the provided search results (some of which might be irrelevant).",
@@ -42,17 +60,29 @@ class PromptBuilder:
         self._tokenizer = tokenizer
         self._prompting_mode = prompting_mode
         self._system, self._user_template = self._get_prompt_components()
+        # "Document [i](Title: " prefixes by index (index 0 is unused)
+        self._document_prefixes: List[str] = [""]
+        self._chat_template_parts = self._get_chat_template_parts()
 
     def build(
         self,
         question: str,
-        documents: Optional[List[Document]] = None
+        documents: Optional[Union[List[Document], Sequence[int]]] = None,
+        document_table: Optional[DocumentTable] = None,
+        permutation: Optional[Sequence[int]] = None
     ) -> str:
-
+        """
+        Builds the prompt of `question` (and its `documents` on openbook
+        modes). If `document_table` is passed, `documents` are indices of
+        interned documents in that table. If `permutation` is passed, the
+        documents are formatted in the permutation order.
+        """
         if self._prompting_mode is PromptingMode.CLOSEDBOOK:
             user_prompt = self._user_template.format(question=question)
         else:
-            search_results = self._format_documents(documents)
+            search_results = self._format_documents(
+                documents, document_table, permutation
+            )
             user_prompt = self._user_template.format(
                 search_results=search_results,
                 question=question
@@ -62,10 +92,200 @@ class PromptBuilder:
             prompt = f"{self._system}\n\n{user_prompt}"
             return prompt
 
+        if self._chat_template_parts is not None and \
+                user_prompt.strip() == user_prompt:
+            prefix, suffix = self._chat_template_parts
+            return "".join((prefix, user_prompt, suffix))
+
+        return self._render_chat_template(user_prompt)
+
+    def build_many(
+        self,
+        questions: List[str],
+        documents_list: Optional[
+            List[Union[List[Document], Sequence[int]]]
+        ] = None,
+        document_table: Optional[DocumentTable] = None,
+        permutations: Optional[List[Optional[Sequence[int]]]] = None,
+        tokenize: Optional[bool] = False
+    ) -> Union[List[str], List[TokenizedPrompt]]:
+        """
+        Builds the prompts of `questions` (and their `documents_list` on
+        openbook modes), see `build`. `permutations` holds the documents
+        order of each question (or None to keep the documents order).
+
+        If `tokenize` is True, the prompts are tokenized in a single batch
+        and returned as `TokenizedPrompt`s (see `tokenize_prompts`).
+        """
+        if self._prompting_mode is PromptingMode.CLOSEDBOOK:
+            prompts = [self.build(question) for question in questions]
+        else:
+            if permutations is None:
+                permutations = [None] * len(questions)
+            prompts = [
+                self.build(question, documents, document_table, permutation)
+                for question, documents, permutation in zip(
+                    questions, documents_list, permutations
+                )
+            ]
+
+        if tokenize is True:
+            return self.tokenize_prompts(prompts)
+        return prompts
+
+    def fit_documents(
+        self,
+        questions: List[str],
+        documents_list: List[Union[List[Document], Sequence[int]]],
+        token_budget: int,
+        token_length_index: "TokenLengthIndex",
+        document_table: Optional[DocumentTable] = None,
+        permutations: Optional[List[Optional[Sequence[int]]]] = None
+    ) -> Tuple[
+        List[Union[List[Document], Sequence[int]]],
+        Optional[List[Optional[Sequence[int]]]],
+        List[List[int]]
+    ]:
+        """
+        Fits the prompts of `questions` into `token_budget` tokens, by
+        dropping the lowest score non-gold documents of the prompts that
+        exceed it (the gold document is never dropped). The prompts token
+        counts are taken from `token_length_index`, so the prompts are not
+        built or tokenized while fitting.
+
+        Returns the fitted documents list and permutations (both remapped
+        to the kept documents), and the indices (in each example documents
+        list) of the dropped documents.
+        """
+        if permutations is None:
+            permutations = [None] * len(questions)
+        num_tokens_list = token_length_index.count_tokens(
+            questions, documents_list, document_table
+        )
+
+        fitted_documents_list, fitted_permutations, dropped_idxs_list = [], [], []
+        for documents, permutation, num_tokens in zip(
+            documents_list, permutations, num_tokens_list
+        ):
+            dropped_idxs = []
+            if num_tokens > token_budget:
+                dropped_idxs = self._get_dropped_documents(
+                    documents, num_tokens, token_budget,
+                    token_length_index, document_table
+                )
+            if dropped_idxs:
+                documents, permutation = _drop_documents(
+                    documents, permutation, dropped_idxs
+                )
+            fitted_documents_list.append(documents)
+            fitted_permutations.append(permutation)
+            dropped_idxs_list.append(dropped_idxs)
+
+        if all(permutation is None for permutation in fitted_permutations):
+            fitted_permutations = None
+        return fitted_documents_list, fitted_permutations, dropped_idxs_list
+
+    def tokenize_prompts(self, prompts: List[str]) -> List[TokenizedPrompt]:
+        """
+        Tokenizes built `prompts` the way the llm tokenizes a text prompt
+        (with the tokenizer special tokens), so the token ids can be passed
+        to it directly.
+        """
+        num_special_tokens = self._tokenizer.num_special_tokens
+        return [
+            TokenizedPrompt(
+                text=prompt,
+                token_ids=token_ids,
+                num_tokens=len(token_ids) - num_special_tokens
+            )
+            for prompt, token_ids in zip(
+                prompts, self._tokenizer.encode_batch(prompts)
+            )
+        ]
+
+    def _render_chat_template(self, user_prompt: str) -> str:
         messages = get_messages_list(user=user_prompt, system=self._system)
         prompt = self._tokenizer.apply_chat_template(messages, tokenize=False)
         return prompt
 
+    def _get_chat_template_parts(self) -> Optional[Tuple[str, str]]:
+        """
+        Renders the chat template once around a sentinel user content and
+        returns the (prefix, suffix) rendered around it, so prompts can be
+        built by splicing the user prompt in between instead of rendering
+        the (Jinja) template per prompt.
+
+        Returns None if the template isn't splice-safe - the sentinel isn't
+        rendered exactly once as is, or the probe contents are not
+        reproduced by splicing.
+        """
+        if not self._tokenizer.is_chat_model:
+            return None
+
+        rendered = self._render_chat_template(self._CHAT_TEMPLATE_SENTINEL)
+        if rendered.count(self._CHAT_TEMPLATE_SENTINEL) != 1:
+            logging.warning(
+                "Chat template can't be spliced, rendering it per prompt."
+            )
+            return None
+
+        prefix, suffix = rendered.split(self._CHAT_TEMPLATE_SENTINEL)
+        for probe in self._CHAT_TEMPLATE_PROBES:
+            if self._render_chat_template(probe) != prefix + probe + suffix:
+                logging.warning(
+                    "Chat template doesn't round-trip, rendering it per prompt."
+                )
+                return None
+        return prefix, suffix
+
+    def _get_dropped_documents(
+        self,
+        documents: Union[List[Document], Sequence[int]],
+        num_tokens: int,
+        token_budget: int,
+        token_length_index: "TokenLengthIndex",
+        document_table: Optional[DocumentTable] = None
+    ) -> List[int]:
+
+        if document_table is not None:
+            documents = document_table.resolve(documents)
+        document_lengths = token_length_index.get_document_lengths(documents)
+        num_documents = len(documents)
+        # the prompt length without its template and documents
+        question_length = num_tokens - sum(document_lengths) - \
+            token_length_index.get_template_length(num_documents)
+
+        # the lowest score documents are dropped first (documents without a
+        # score first of all), and among equal scores the later ones
+        candidates = sorted(
+            (
+                idx for idx, document in enumerate(documents)
+                if document.isgold is not True
+            ),
+            key=lambda idx: (
+                documents[idx].score is not None,
+                documents[idx].score or 0.0,
+                -idx
+            )
+        )
+        dropped_idxs = []
+        for idx in candidates:
+            if num_tokens <= token_budget:
+                break
+            dropped_idxs.append(idx)
+            num_documents -= 1
+            num_tokens -= document_lengths[idx] + \
+                token_length_index.get_template_length(num_documents + 1) - \
+                token_length_index.get_template_length(num_documents)
+
+        if num_tokens > token_budget:
+            logging.warning(
+                f"Prompt exceeds the token budget ({num_tokens} > " +
+                f"{token_budget}) after dropping all non-gold documents."
+            )
+        # keep the recorded indices in the documents order
+        return sorted(dropped_idxs)
+
     def _get_prompt_components(self) -> Tuple[str, str]:
         prompt_template_parts = self._TEMPLATE_MAPPING[self._prompting_mode]
         syetem = prompt_template_parts["system"]
@@ -73,8 +293,48 @@ class PromptBuilder:
         user_template = "\n\n".join(user_parts)
         return syetem, user_template
 
-    def _format_documents(self, documents: List[Document]) -> str:
-        return "\n".join(
-            f"Document [{document_index}](Title: {document.title}) {document.text}"
-            for document_index, document in enumerate(documents, 1)
-        )
+    def _format_documents(
+        self,
+        documents: Union[List[Document], Sequence[int]],
+        document_table: Optional[DocumentTable] = None,
+        permutation: Optional[Sequence[int]] = None
+    ) -> str:
+
+        if permutation is not None:
+            documents = [documents[idx] for idx in permutation]
+        if document_table is not None:
+            documents = document_table.resolve(documents)
+
+        # the search results are joined once from the documents fields and
+        # the cached index prefixes, without an intermediate string per
+        # document (which would copy every document text twice)
+        prefixes = self._get_document_prefixes(len(documents))
+        parts = []
+        for prefix, document in zip(prefixes, documents):
+            parts += (prefix, document.title, ") ", document.text)
+        return "".join(parts)
+
+    def _get_document_prefixes(self, num_documents: int) -> List[str]:
+        # documents after the first one start on a new line
+        while len(self._document_prefixes) <= num_documents:
+            idx = len(self._document_prefixes)
+            prefix = f"Document [{idx}](Title: "
+            self._document_prefixes.append(prefix if idx == 1 else "\n" + prefix)
+        return self._document_prefixes[1:num_documents + 1]
+
+
+def _drop_documents(
+    documents: Union[List[Document], Sequence[int]],
+    permutation: Optional[Sequence[int]],
+    dropped_idxs: List[int]
+) -> Tuple[List[Union[Document, int]], Optional[List[int]]]:
+
+    dropped = set(dropped_idxs)
+    kept_idxs = [idx for idx in range(len(documents)) if idx not in dropped]
+    if permutation is not None:
+        # the permutation indices are remapped to the kept documents
+        new_idxs = {idx: new_idx for new_idx, idx in enumerate(kept_idxs)}
+        permutation = [
+            new_idxs[idx] for idx in permutation if idx not in dropped
+        ]
+    return [documents[idx] for idx in kept_idxs], permutation
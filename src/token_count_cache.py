@@ -0,0 +1,186 @@
+from typing import List, Optional, Any
+import numpy as np
+import sqlite3
+import hashlib
+import logging
+import time
+import os
+
+
+# sqlite limits the number of query parameters
+_QUERY_CHUNK_SIZE = 500
+
+
+class TokenCountCache:
+    """
+    A disk backed (SQLite) cache of prompt token counts and token ids, so
+    re-runs over the same prompts don't tokenize them again.
+
+    The counts and token ids are keyed by a hash of the tokenizer identity,
+    the tokenization variant (e.g. with or without the chat template) and
+    the prompt text. The cache holds at most `max_entries` counts and
+    `max_entries` token ids - the least recently used ones are evicted
+    first.
+    """
+
+    def __init__(
+        self,
+        cache_path: str,
+        tokenizer_id: str,
+        max_entries: int
+    ) -> None:
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._cache_path = cache_path
+        self._tokenizer_id = tokenizer_id
+        self._max_entries = max_entries
+        # the cache may be shared by concurrent experiments
+        self._connection = sqlite3.connect(cache_path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS token_counts (" +
+            "key INTEGER PRIMARY KEY, " +
+            "num_tokens INTEGER NOT NULL, " +
+            "last_used INTEGER NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS token_counts_last_used " +
+            "ON token_counts (last_used)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS token_ids (" +
+            "key INTEGER PRIMARY KEY, " +
+            "token_ids BLOB NOT NULL, " +
+            "last_used INTEGER NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS token_ids_last_used " +
+            "ON token_ids (last_used)"
+        )
+        self._connection.commit()
+        logging.info(f"Using token count cache: {cache_path}")
+
+    def get_many(self, texts: List[str], variant: str) -> List[Optional[int]]:
+        """
+        Returns the cached token count of each of `texts`, or None for the
+        texts that are not cached.
+        """
+        return self._get_many("token_counts", "num_tokens", texts, variant)
+
+    def put_many(
+        self,
+        texts: List[str],
+        counts: List[int],
+        variant: str
+    ) -> None:
+        """
+        Caches the token counts of `texts`, evicting the least recently
+        used counts beyond `max_entries`.
+        """
+        self._put_many("token_counts", texts, counts, variant)
+
+    def get_token_ids_many(
+        self,
+        texts: List[str],
+        variant: str
+    ) -> List[Optional[List[int]]]:
+        """
+        Returns the cached token ids of each of `texts`, or None for the
+        texts that are not cached.
+        """
+        blobs = self._get_many("token_ids", "token_ids", texts, variant)
+        return [
+            np.frombuffer(blob, dtype=np.int32).tolist()
+            if blob is not None else None
+            for blob in blobs
+        ]
+
+    def put_token_ids_many(
+        self,
+        texts: List[str],
+        token_ids_list: List[List[int]],
+        variant: str
+    ) -> None:
+        """
+        Caches the token ids of `texts`, evicting the least recently used
+        token ids beyond `max_entries`.
+        """
+        blobs = [
+            np.asarray(token_ids, dtype=np.int32).tobytes()
+            for token_ids in token_ids_list
+        ]
+        self._put_many("token_ids", texts, blobs, variant)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __len__(self) -> int:
+        (num_entries,) = self._connection.execute(
+            "SELECT COUNT(*) FROM token_counts"
+        ).fetchone()
+        return num_entries
+
+    def _get_many(
+        self,
+        table: str,
+        column: str,
+        texts: List[str],
+        variant: str
+    ) -> List[Optional[Any]]:
+
+        keys = [self._get_key(text, variant) for text in texts]
+        values = {}
+        for start in range(0, len(keys), _QUERY_CHUNK_SIZE):
+            chunk = keys[start:start + _QUERY_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            values.update(self._connection.execute(
+                f"SELECT key, {column} FROM {table} " +
+                f"WHERE key IN ({placeholders})",
+                chunk
+            ))
+
+        if values:
+            with self._connection:
+                self._connection.executemany(
+                    f"UPDATE {table} SET last_used = ? WHERE key = ?",
+                    [(time.time_ns(), key) for key in values]
+                )
+        return [values.get(key) for key in keys]
+
+    def _put_many(
+        self,
+        table: str,
+        texts: List[str],
+        values: List[Any],
+        variant: str
+    ) -> None:
+
+        now = time.time_ns()
+        with self._connection:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)",
+                [
+                    (self._get_key(text, variant), value, now)
+                    for text, value in zip(texts, values)
+                ]
+            )
+            (num_entries,) = self._connection.execute(
+                f"SELECT COUNT(*) FROM {table}"
+            ).fetchone()
+            if num_entries > self._max_entries:
+                self._connection.execute(
+                    f"DELETE FROM {table} WHERE key IN (" +
+                    f"SELECT key FROM {table} ORDER BY last_used LIMIT ?)",
+                    (num_entries - self._max_entries,)
+                )
+
+    def _get_key(self, text: str, variant: str) -> int:
+        # a 64 bit key - sqlite integer primary keys are signed
+        digest = hashlib.blake2b(
+            f"{self._tokenizer_id}\0{variant}\0{text}".encode("utf-8"),
+            digest_size=8
+        ).digest()
+        return int.from_bytes(digest, "little", signed=True)
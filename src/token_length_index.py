@@ -0,0 +1,234 @@
+from common.entities import Document, DocumentTable, TokenizedPrompt
+from src.prompt_builder import PromptBuilder
+from src.wrappers import HfTokenizer
+
+from typing import List, Dict, Tuple, Sequence, Union, Optional
+import numpy as np
+import tempfile
+import hashlib
+import logging
+import os
+
+
+class TokenLengthIndex:
+    """
+    Derives prompt token counts from cached per-document token counts,
+    instead of tokenizing the entire (multi-thousand tokens) prompt.
+
+    A prompt is a fixed template (system message, chat template and the
+    search results prefixes) around its question and documents, hence its
+    length is the template length for its number of documents plus the
+    question and documents lengths. The template length is calibrated once
+    per number of documents with a probe prompt, which also accounts for
+    the tokens merged across the documents boundaries.
+
+    The count is exact as long as the tokenizer merges the boundaries of
+    the real documents the same way as the probe ones - `verify` checks it
+    against the full tokenization of a sample of prompts.
+
+    The document counts are persisted to `index_path` (see `save`), keyed
+    by the document title and text, so they are computed once per
+    tokenizer and dataset.
+    """
+
+    _PROBE_QUESTION = "who wrote the probe question?"
+    _PROBE_DOCUMENT = Document(title="Probe", text="A probe document text.")
+
+    def __init__(
+        self,
+        prompt_builder: PromptBuilder,
+        tokenizer: HfTokenizer,
+        index_path: Optional[str] = None
+    ) -> None:
+
+        self._prompt_builder = prompt_builder
+        self._tokenizer = tokenizer
+        self._index_path = index_path
+        self._document_lengths = self._load()
+        self._num_saved_documents = len(self._document_lengths)
+        # template length by number of documents
+        self._template_lengths: Dict[int, int] = {}
+
+    def count_tokens(
+        self,
+        questions: List[str],
+        documents_list: Optional[
+            List[Union[List[Document], Sequence[int]]]
+        ] = None,
+        document_table: Optional[DocumentTable] = None
+    ) -> List[int]:
+        """
+        Returns the token count of the prompt of each of `questions` (and
+        their `documents_list` on openbook modes), matching the
+        `TokenizedPrompt.num_tokens` of the built prompts. The documents
+        order doesn't change the count, hence no permutations are needed.
+
+        Documents that are not indexed yet are tokenized (in a batch) and
+        added to the index.
+        """
+        question_lengths = self._tokenizer.count_tokens_batch(
+            questions, prompt_with_inst_tokens=True
+        )
+        if documents_list is None:
+            return [
+                self.get_template_length(0) + question_length
+                for question_length in question_lengths
+            ]
+
+        if document_table is not None:
+            documents_list = [
+                document_table.resolve(documents) for documents in documents_list
+            ]
+        keys_list = [
+            [_get_document_key(document) for document in documents]
+            for documents in documents_list
+        ]
+        self._add(documents_list, keys_list)
+
+        document_lengths = self._document_lengths
+        return [
+            self.get_template_length(len(keys)) +
+            question_length +
+            sum(document_lengths[key] for key in keys)
+            for question_length, keys in zip(question_lengths, keys_list)
+        ]
+
+    def get_document_lengths(self, documents: List[Document]) -> List[int]:
+        """
+        Returns the token count of each of `documents` search result body
+        (without its fixed prefix, which is part of the template length).
+        """
+        keys = [_get_document_key(document) for document in documents]
+        self._add([documents], [keys])
+        return [self._document_lengths[key] for key in keys]
+
+    def get_template_length(self, num_documents: int) -> int:
+        """
+        Returns the token count of a prompt with `num_documents` documents,
+        without its question and documents bodies.
+        """
+        template_length = self._template_lengths.get(num_documents)
+        if template_length is not None:
+            return template_length
+
+        # the probe prompt length, without its question and documents
+        probe_documents = [self._PROBE_DOCUMENT] * num_documents
+        (probe_prompt,) = self._prompt_builder.build_many(
+            [self._PROBE_QUESTION], [probe_documents], tokenize=True
+        )
+        probe_question_length, probe_document_length = \
+            self._tokenizer.count_tokens_batch(
+                [
+                    self._PROBE_QUESTION,
+                    _get_document_body(self._PROBE_DOCUMENT)
+                ],
+                prompt_with_inst_tokens=True
+            )
+        template_length = probe_prompt.num_tokens - probe_question_length - \
+            num_documents * probe_document_length
+        self._template_lengths[num_documents] = template_length
+        return template_length
+
+    def verify(
+        self,
+        prompts: List[TokenizedPrompt],
+        questions: List[str],
+        documents_list: Optional[
+            List[Union[List[Document], Sequence[int]]]
+        ] = None,
+        document_table: Optional[DocumentTable] = None
+    ) -> Tuple[int, int]:
+        """
+        Compares the index counts of `questions` prompts with their full
+        tokenization (`prompts`) and returns the number of exact counts and
+        the maximal absolute count error.
+        """
+        counts = self.count_tokens(questions, documents_list, document_table)
+        errors = [
+            abs(count - prompt.num_tokens)
+            for count, prompt in zip(counts, prompts)
+        ]
+        num_exact = sum(error == 0 for error in errors)
+        return num_exact, max(errors, default=0)
+
+    def save(self) -> None:
+        """
+        Saves the document counts to `index_path` (if there are new ones).
+        The index is an optimization, hence a failed save only warns.
+        """
+        if (
+            self._index_path is None or
+            len(self._document_lengths) == self._num_saved_documents
+        ):
+            return
+
+        index_dir, index_name = os.path.split(self._index_path)
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=f".{index_name}.")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    keys=np.fromiter(self._document_lengths.keys(), dtype=np.int64),
+                    lengths=np.fromiter(
+                        self._document_lengths.values(), dtype=np.int32
+                    )
+                )
+            os.replace(tmp_path, self._index_path)
+            self._num_saved_documents = len(self._document_lengths)
+            logging.info(f"Saved token length index: {self._index_path}")
+        except OSError as e:
+            logging.warning(
+                f"Could not save token length index {self._index_path}: {e}"
+            )
+
+    def _load(self) -> Dict[int, int]:
+        if self._index_path is None or not os.path.exists(self._index_path):
+            return {}
+
+        logging.info(f"Loading token length index: {self._index_path}")
+        with np.load(self._index_path) as index:
+            return dict(zip(index["keys"].tolist(), index["lengths"].tolist()))
+
+    def _add(
+        self,
+        documents_list: List[List[Document]],
+        keys_list: List[List[int]]
+    ) -> None:
+
+        new_documents = {}
+        for documents, keys in zip(documents_list, keys_list):
+            for document, key in zip(documents, keys):
+                if key not in self._document_lengths:
+                    new_documents[key] = document
+
+        if not new_documents:
+            return
+
+        bodies = [
+            _get_document_body(document) for document in new_documents.values()
+        ]
+        lengths = self._tokenizer.count_tokens_batch(
+            bodies, prompt_with_inst_tokens=True
+        )
+        self._document_lengths.update(zip(new_documents.keys(), lengths))
+
+
+def get_index_path(index_dir: str, model: str) -> str:
+    # one index per tokenizer (model), e.g.
+    # meta-llama/Llama-3.1-8B-Instruct --> meta-llama--Llama-3.1-8B-Instruct
+    return f"{index_dir}/{model.replace('/', '--')}.npz"
+
+
+def _get_document_body(document: Document) -> str:
+    # the part of the document search result that is not a fixed prefix
+    # (see `PromptBuilder._format_documents`)
+    return f"(Title: {document.title}) {document.text}"
+
+
+def _get_document_key(document: Document) -> int:
+    # a stable (unlike `hash`) 64 bit key of the rendered document content
+    digest = hashlib.blake2b(
+        f"{document.title}\0{document.text}".encode("utf-8"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "little", signed=True)
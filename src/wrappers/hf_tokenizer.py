@@ -1,15 +1,32 @@
+from src.token_count_cache import TokenCountCache
 from common.utils import get_messages_list
+import common.consts as consts
 
 from transformers import AutoTokenizer, TensorType
 from typing import List, Dict, Optional, Any
+import hashlib
 
 
 class HfTokenizer:
 
-    def __init__(self, model: str) -> None:
+    def __init__(
+        self,
+        model: str,
+        token_count_cache_path: Optional[str] = None
+    ) -> None:
+
         self._model = model
         self._tokenizer = AutoTokenizer.from_pretrained(model)
         self._is_chat_model = self._tokenizer.chat_template is not None
+        # when set, prompt token counts and token ids are cached on disk
+        # across runs
+        self._token_count_cache = None
+        if token_count_cache_path is not None:
+            self._token_count_cache = TokenCountCache(
+                cache_path=token_count_cache_path,
+                tokenizer_id=self._get_tokenizer_id(),
+                max_entries=consts.DEFAULT_TOKEN_COUNT_CACHE_SIZE
+            )
 
     @property
     def model(self) -> str:
@@ -45,6 +62,49 @@ class HfTokenizer:
             **kwargs
         )
 
+    def encode_batch(
+        self,
+        texts: List[str],
+        add_special_tokens: bool = True
+    ) -> List[List[int]]:
+        """
+        Returns the token ids of each of `texts`, encoded in a single
+        (batched) tokenizer call.
+
+        With a token count cache, only the texts that are not cached yet
+        are encoded.
+        """
+        if self._token_count_cache is None:
+            return self._encode_batch(texts, add_special_tokens)
+
+        variant = "special_tokens" if add_special_tokens is True else "text"
+        token_ids_list = self._token_count_cache.get_token_ids_many(
+            texts, variant
+        )
+        missing_idxs = [
+            idx for idx, token_ids in enumerate(token_ids_list)
+            if token_ids is None
+        ]
+        if missing_idxs:
+            missing_texts = [texts[idx] for idx in missing_idxs]
+            missing_token_ids_list = self._encode_batch(
+                missing_texts, add_special_tokens
+            )
+            self._token_count_cache.put_token_ids_many(
+                missing_texts, missing_token_ids_list, variant
+            )
+            for idx, token_ids in zip(missing_idxs, missing_token_ids_list):
+                token_ids_list[idx] = token_ids
+        return token_ids_list
+
+    @property
+    def num_special_tokens(self) -> int:
+        """
+        Number of special tokens (e.g. BOS) added when a single text is
+        encoded with `add_special_tokens=True`.
+        """
+        return self._tokenizer.num_special_tokens_to_add()
+
     def apply_chat_template(
         self,
         conversation: List[Dict[str, str]],
@@ -95,6 +155,11 @@ class HfTokenizer:
         """
         if kwargs.get("prompt"):
             prompt = kwargs.get("prompt")
+            if self._token_count_cache is not None:
+                (num_tokens,) = self.count_tokens_batch(
+                    [prompt], prompt_with_inst_tokens
+                )
+                return num_tokens
             if prompt_with_inst_tokens is True:
                 tokenized_prompt = self.tokenize(prompt)
                 return len(tokenized_prompt)
@@ -111,3 +176,86 @@ class HfTokenizer:
 
         tokenized_messages = self.apply_chat_template(messages)
         return len(tokenized_messages)
+
+    def count_tokens_batch(
+        self,
+        prompts: List[str],
+        prompt_with_inst_tokens: Optional[bool] = False
+    ) -> List[int]:
+        """
+        Batched version of `count_tokens` for `prompts` - returns the same
+        counts, but encodes all prompts in a single tokenizer call (which
+        the fast tokenizers run in parallel, on multiple threads) and
+        returns only their lengths.
+
+        With a token count cache, only the prompts that are not cached yet
+        are tokenized.
+        """
+        if self._token_count_cache is None:
+            return self._count_tokens_batch(prompts, prompt_with_inst_tokens)
+
+        variant = "prompt" if prompt_with_inst_tokens is True else "messages"
+        num_tokens_list = self._token_count_cache.get_many(prompts, variant)
+        missing_idxs = [
+            idx for idx, num_tokens in enumerate(num_tokens_list)
+            if num_tokens is None
+        ]
+        if missing_idxs:
+            missing_prompts = [prompts[idx] for idx in missing_idxs]
+            missing_num_tokens_list = self._count_tokens_batch(
+                missing_prompts, prompt_with_inst_tokens
+            )
+            self._token_count_cache.put_many(
+                missing_prompts, missing_num_tokens_list, variant
+            )
+            for idx, num_tokens in zip(missing_idxs, missing_num_tokens_list):
+                num_tokens_list[idx] = num_tokens
+        return num_tokens_list
+
+    def _count_tokens_batch(
+        self,
+        prompts: List[str],
+        prompt_with_inst_tokens: Optional[bool] = False
+    ) -> List[int]:
+
+        if prompt_with_inst_tokens is not True:
+            prompts = [
+                self.apply_chat_template(
+                    get_messages_list(user=prompt), tokenize=False
+                )
+                for prompt in prompts
+            ]
+
+        # chat templates hold their own special tokens, and already rendered
+        # prompts are counted without them (like `tokenize`)
+        return self._tokenizer(
+            prompts,
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_length=True
+        )["length"]
+
+    def _encode_batch(
+        self,
+        texts: List[str],
+        add_special_tokens: bool = True
+    ) -> List[List[int]]:
+
+        return self._tokenizer(
+            texts,
+            add_special_tokens=add_special_tokens,
+            return_attention_mask=False
+        )["input_ids"]
+
+    def _get_tokenizer_id(self) -> str:
+        # the counts depend on the tokenizer vocabulary and rules (not only
+        # on the model name, which may point to an updated revision) and on
+        # its chat template
+        if self._tokenizer.is_fast:
+            definition = self._tokenizer.backend_tokenizer.to_str()
+        else:
+            definition = str(sorted(self._tokenizer.get_vocab().items()))
+        hasher = hashlib.blake2b(digest_size=16)
+        for part in [self._model, definition, self._tokenizer.chat_template]:
+            hasher.update(f"{part}\0".encode("utf-8"))
+        return hasher.hexdigest()
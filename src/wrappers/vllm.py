@@ -1,5 +1,17 @@
-from typing import Optional, List
-from vllm import LLM, SamplingParams
+from src.generation_cache import GenerationCache
+from common.entities import TokenizedPrompt
+import common.consts as consts
+
+from typing import Optional, List, Dict, Tuple, Union, Iterator
+from vllm import (
+    LLM, SamplingParams, RequestOutput, AsyncEngineArgs, AsyncLLMEngine
+)
+from vllm.inputs import TokensPrompt
+from concurrent.futures import Future
+import threading
+import asyncio
+import queue
+import uuid
 
 
 class vLLMWrapper:
@@ -13,41 +25,150 @@ class vLLMWrapper:
         dtype: str,
         num_gpus: int,
         max_model_len: int,
-        gpu_memory_utilization: float
+        gpu_memory_utilization: float,
+        enable_prefix_caching: bool = False,
+        async_engine: bool = False,
+        generation_cache_path: Optional[str] = None
     ) -> None:
 
-        self._llm = LLM(
-            model=model,
-            dtype=dtype,
-            tensor_parallel_size=num_gpus,
-            trust_remote_code=True,
-            max_model_len=max_model_len,
-            gpu_memory_utilization=gpu_memory_utilization
-        )
+        engine_args = {
+            "model": model,
+            "dtype": dtype,
+            "tensor_parallel_size": num_gpus,
+            "trust_remote_code": True,
+            "max_model_len": max_model_len,
+            "gpu_memory_utilization": gpu_memory_utilization,
+            "enable_prefix_caching": enable_prefix_caching
+        }
+        # on async engine mode the engine runs in an event loop on a
+        # background thread, and `generate_stream` yields the responses
+        # as they finish
+        self._loop = None
+        if async_engine is True:
+            self._llm = AsyncLLMEngine.from_engine_args(
+                AsyncEngineArgs(**engine_args)
+            )
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        else:
+            self._llm = LLM(**engine_args)
+        # when set, completions are cached on disk across runs
+        self._generation_cache = None
+        if generation_cache_path is not None:
+            self._generation_cache = GenerationCache(
+                cache_path=generation_cache_path,
+                model=model,
+                dtype=dtype,
+                max_entries=consts.DEFAULT_GENERATION_CACHE_SIZE,
+                max_age_days=consts.DEFAULT_GENERATION_CACHE_MAX_AGE_DAYS
+            )
+        # prompt tokens (and the ones read from the prefix cache) of all
+        # the generated prompts so far
+        self._num_prompt_tokens = 0
+        self._num_cached_tokens = None
 
     @property
-    def llm(self) -> LLM:
+    def llm(self) -> Union[LLM, AsyncLLMEngine]:
         return self._llm
 
+    @property
+    def prefix_cache_hit_ratio(self) -> Optional[float]:
+        """
+        Fraction of the generated prompts tokens that were read from the
+        prefix cache, or None if vLLM doesn't report it.
+        """
+        if self._num_cached_tokens is None or self._num_prompt_tokens == 0:
+            return None
+        return self._num_cached_tokens / self._num_prompt_tokens
+
+    @property
+    def generation_cache_stats(self) -> Optional[Dict[str, int]]:
+        """
+        The generation cache hits and misses, or None without a cache.
+        """
+        if self._generation_cache is None:
+            return None
+        return self._generation_cache.stats
+
+    def reset_stats(self) -> None:
+        """
+        Resets the prefix cache and generation cache stats, so an llm that
+        is shared by several experiments reports the stats of each of them.
+        """
+        self._num_prompt_tokens = 0
+        self._num_cached_tokens = None
+        if self._generation_cache is not None:
+            self._generation_cache.reset_stats()
+
     def generate_batch(
         self,
-        prompts: List[str],
+        prompts: Union[List[str], List[TokenizedPrompt]],
         temperature: float,
         max_tokens: int,
         top_p: float
     ) -> List[str]:
+        """
+        Generates a response to each of `prompts`. Tokenized prompts are
+        passed to vLLM as token ids, so vLLM doesn't tokenize them again.
 
-        sampling_params = SamplingParams(
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=top_p
+        With a generation cache, only the prompts that are not cached yet
+        are generated.
+        """
+        if self._generation_cache is not None:
+            return self._generation_cache.generate(
+                prompts,
+                _get_sampling_params_dict(temperature, max_tokens, top_p),
+                lambda missing_prompts: self._generate_batch(
+                    missing_prompts, temperature, max_tokens, top_p
+                )
+            )
+        return self._generate_batch(prompts, temperature, max_tokens, top_p)
+
+    def generate_stream(
+        self,
+        prompts: Union[List[str], List[TokenizedPrompt]],
+        temperature: float,
+        max_tokens: int,
+        top_p: float
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Submits `prompts` to the async engine and returns an iterator over
+        their (prompt index, response) pairs, in the order the responses
+        finish. The prompts are submitted before this method returns, so
+        they are decoded while the caller consumes earlier responses.
+
+        With a generation cache, the cached responses are yielded first and
+        only the rest of the prompts are submitted.
+        """
+        if self._generation_cache is None:
+            return self._generate_stream(
+                prompts, temperature, max_tokens, top_p
+            )
+
+        sampling_params = _get_sampling_params_dict(
+            temperature, max_tokens, top_p
+        )
+        responses = self._generation_cache.get_many(prompts, sampling_params)
+        missing_idxs = [
+            idx for idx, response in enumerate(responses) if response is None
+        ]
+        missing_responses = self._generate_stream(
+            [prompts[idx] for idx in missing_idxs],
+            temperature,
+            max_tokens,
+            top_p
+        ) if missing_idxs else iter([])
+        return self._iter_cached_responses(
+            prompts,
+            responses,
+            missing_idxs,
+            missing_responses,
+            sampling_params
         )
-        results = self._llm.generate(prompts, sampling_params)
-        return [res.outputs[0].text for res in results]
 
     def generate(
         self,
-        prompt: str,
+        prompt: Union[str, TokenizedPrompt],
         temperature: float,
         max_tokens: int,
         top_p: float
@@ -59,3 +180,155 @@ class vLLMWrapper:
             max_tokens=max_tokens,
             top_p=top_p
         )[0]
+
+    def _generate_batch(
+        self,
+        prompts: Union[List[str], List[TokenizedPrompt]],
+        temperature: float,
+        max_tokens: int,
+        top_p: float
+    ) -> List[str]:
+
+        if self._loop is not None:
+            responses = [None] * len(prompts)
+            for idx, response in self._generate_stream(
+                prompts, temperature, max_tokens, top_p
+            ):
+                responses[idx] = response
+            return responses
+
+        sampling_params = SamplingParams(
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p
+        )
+        results = self._llm.generate(
+            _get_engine_prompts(prompts), sampling_params
+        )
+        self._update_prefix_cache_stats(results)
+        return [res.outputs[0].text for res in results]
+
+    def _generate_stream(
+        self,
+        prompts: Union[List[str], List[TokenizedPrompt]],
+        temperature: float,
+        max_tokens: int,
+        top_p: float
+    ) -> Iterator[Tuple[int, str]]:
+
+        if self._loop is None:
+            raise RuntimeError(
+                "'generate_stream' requires the async engine mode."
+            )
+
+        sampling_params = SamplingParams(
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p
+        )
+        responses = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._generate_async(
+                _get_engine_prompts(prompts), sampling_params, responses
+            ),
+            self._loop
+        )
+        return self._iter_responses(len(prompts), responses, future)
+
+    async def _generate_async(
+        self,
+        prompts: List[Union[str, TokensPrompt]],
+        sampling_params: SamplingParams,
+        responses: queue.Queue
+    ) -> None:
+
+        async def generate(idx: int, prompt: Union[str, TokensPrompt]) -> None:
+            result = None
+            async for result in self._llm.generate(
+                prompt, sampling_params, request_id=uuid.uuid4().hex
+            ):
+                pass
+            self._update_prefix_cache_stats([result])
+            responses.put((idx, result.outputs[0].text))
+
+        try:
+            await asyncio.gather(*(
+                generate(idx, prompt) for idx, prompt in enumerate(prompts)
+            ))
+        except Exception as e:
+            # wakes the consumer up, which re-raises the error
+            responses.put(e)
+            raise
+
+    def _iter_responses(
+        self,
+        num_prompts: int,
+        responses: queue.Queue,
+        future: Future
+    ) -> Iterator[Tuple[int, str]]:
+
+        for _ in range(num_prompts):
+            response = responses.get()
+            if isinstance(response, Exception):
+                raise response
+            yield response
+        future.result()
+
+    def _iter_cached_responses(
+        self,
+        prompts: Union[List[str], List[TokenizedPrompt]],
+        responses: List[Optional[str]],
+        missing_idxs: List[int],
+        missing_responses: Iterator[Tuple[int, str]],
+        sampling_params: Dict[str, float]
+    ) -> Iterator[Tuple[int, str]]:
+
+        for idx, response in enumerate(responses):
+            if response is not None:
+                yield idx, response
+
+        # the generated responses are cached together once the stream ends
+        # (or is closed), so the consumer isn't blocked by a write per
+        # response
+        generated_prompts, generated_responses = [], []
+        try:
+            for missing_idx, response in missing_responses:
+                idx = missing_idxs[missing_idx]
+                generated_prompts.append(prompts[idx])
+                generated_responses.append(response)
+                yield idx, response
+        finally:
+            if generated_prompts:
+                self._generation_cache.put_many(
+                    generated_prompts, generated_responses, sampling_params
+                )
+
+    def _update_prefix_cache_stats(self, results: List[RequestOutput]) -> None:
+        for res in results:
+            self._num_prompt_tokens += len(res.prompt_token_ids)
+            # reported by the vLLM versions that support prefix caching stats
+            num_cached_tokens = getattr(res, "num_cached_tokens", None)
+            if num_cached_tokens is not None:
+                self._num_cached_tokens = \
+                    (self._num_cached_tokens or 0) + num_cached_tokens
+
+
+def _get_engine_prompts(
+    prompts: Union[List[str], List[TokenizedPrompt]]
+) -> List[Union[str, TokensPrompt]]:
+    # tokenized prompts are passed as token ids, so vLLM doesn't tokenize
+    # them again
+    return [
+        TokensPrompt(prompt_token_ids=prompt.token_ids)
+        if isinstance(prompt, TokenizedPrompt) else prompt
+        for prompt in prompts
+    ]
+
+
+def _get_sampling_params_dict(
+    temperature: float,
+    max_tokens: int,
+    top_p: float
+) -> Dict[str, float]:
+    # the sampling params part of the generation cache key
+    return {"temperature": temperature, "max_tokens": max_tokens, "top_p": top_p}
@@ -16,4 +16,9 @@ TEST_MODELS = [
 NON_CHAT_TEST_MODEL = "tiiuae/Falcon3-Mamba-7B-Base"
 
 TEST_DOCUMENT_PATH = f"{DOCUMENTS_FOLDER_PATH}/{DOCUMETS_FOLDER_FILES[0]}"
-NUM_DOCS_TO_TEST = 2
\ No newline at end of file
+NUM_DOCS_TO_TEST = 2
+NUM_WORKERS_TO_TEST = 4
+LINE_RANGE_TO_TEST = (100, 200)
+LINE_INDICES_TO_TEST = [2000, 5, 1327, 5]
+STREAM_WINDOW_TO_TEST = 2
+SEED_TO_TEST = 1
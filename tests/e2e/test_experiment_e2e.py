@@ -1,7 +1,12 @@
 from common.configs.log_config import configure_log
 from common.entities import ExperimentType, PromptingMode
 from experiments import GoldIdxChange, NumDocsChange, AbstractExperiment
+from tests.conftest import download_nq_files_if_needed
+from src.token_length_index import TokenLengthIndex
+from src.prompt_builder import PromptBuilder
 import experiments.runner as experiment_runner
+from src.wrappers import HfTokenizer
+import common.nq_data as nq_data
 import common.consts as common_consts
 import tests.consts as test_consts
 
@@ -36,6 +41,73 @@ def test_num_docs_experiment() -> None:
     _run_e2e_test(args=args, running_cls=NumDocsChange)
 
 
+def test_streamed_token_budget_experiment() -> None:
+    configure_log()
+    token_budget = _get_test_token_budget()
+    results = []
+    for stream_window in [None, test_consts.STREAM_WINDOW_TO_TEST]:
+        args = _get_test_cli_args(
+            experiment=ExperimentType.GOLD_IDX_CHANGE.value,
+            num_docs=common_consts.SUPPORTED_NUM_DOCS[0]
+        )
+        args.prompting_mode = PromptingMode.OPENBOOK_RANDOM
+        args.seed = test_consts.SEED_TO_TEST
+        args.token_budget = token_budget
+        args.max_examples = test_consts.NUM_DOCS_TO_TEST
+        args.stream_window = stream_window
+        experiment = GoldIdxChange(args)
+        experiment.run()
+        results.append(experiment.results["experiments"])
+
+    # the dropped documents indices (in the file order) and the prompts
+    # don't depend on the data being streamed
+    read_results, streamed_results = results
+    assert streamed_results == read_results
+    assert any(
+        dropped_idxs
+        for experiment in read_results.values()
+        for dropped_idxs in experiment["dropped_documents"]
+    )
+
+
+def test_sweep() -> None:
+    args = _get_test_cli_args(
+        experiment=ExperimentType.GOLD_IDX_CHANGE.value,
+        num_docs=common_consts.SUPPORTED_NUM_DOCS[0],
+        gold_idx=common_consts.SUPPORTED_GOLD_IDXS[0]
+    )
+    args.sweep_experiments = [et.value for et in ExperimentType]
+    args.sweep_prompting_modes = [
+        PromptingMode.OPENBOOK.value, PromptingMode.CLOSEDBOOK.value
+    ]
+    args.sweep_gold_idxs = common_consts.SUPPORTED_GOLD_IDXS[:2]
+    # the gold_idx is not swept in the gold_idx_change experiments
+    configs = experiment_runner.get_sweep_configs(args)
+    assert len(configs) == 6
+    assert experiment_runner.is_sweep(args)
+
+    configure_log()
+    experiment_runner.run_sweep(args)
+
+
+def _get_test_token_budget() -> int:
+    # a budget that the first example prompt exceeds, whatever the length
+    # of its documents
+    download_nq_files_if_needed()
+    questions, _, documents_list = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK_RANDOM,
+        seed=test_consts.SEED_TO_TEST,
+        max_examples=1
+    )
+    tokenizer = HfTokenizer(common_consts.DEFAULT_MODEL)
+    index = TokenLengthIndex(
+        PromptBuilder(PromptingMode.OPENBOOK_RANDOM, tokenizer), tokenizer
+    )
+    (num_tokens,) = index.count_tokens(questions, documents_list)
+    return num_tokens * 3 // 4
+
+
 def _run_e2e_test(args: Namespace, running_cls: AbstractExperiment) -> None:
     configure_log()
     logging.info(
@@ -67,5 +139,26 @@ def _get_test_cli_args(
         max_model_len=common_consts.DEFAULT_MAX_MODEL_LEN,
         gpu_memory_utilization=common_consts.DEFAULT_MAX_GPU_UTIL,
         results_dir=None,
-        test_mode=True
+        test_mode=True,
+        stream_window=None,
+        num_workers=common_consts.DEFAULT_NUM_WORKERS,
+        read_compressed=False,
+        seed=None,
+        data_cache_dir=None,
+        intern_documents=False,
+        max_examples=None,
+        verify_token_lengths=False,
+        token_count_cache=None,
+        token_budget=None,
+        enable_prefix_caching=False,
+        prefix_scheduling=False,
+        async_engine=False,
+        flush_results=False,
+        log_progress=False,
+        resume=False,
+        generation_cache=None,
+        sweep_experiments=None,
+        sweep_prompting_modes=None,
+        sweep_num_docs=None,
+        sweep_gold_idxs=None
     )
@@ -1,5 +1,7 @@
+from common.entities import TokenizedPrompt
+
 from unittest.mock import MagicMock
-from typing import List, Optional
+from typing import List, Dict, Tuple, Optional, Union, Iterator
 import logging
 import json
 
@@ -12,7 +14,10 @@ class vLLMWrapperMock:
         dtype: str,
         num_gpus: int,
         max_model_len: int,
-        gpu_memory_utilization: float
+        gpu_memory_utilization: float,
+        enable_prefix_caching: bool = False,
+        async_engine: bool = False,
+        generation_cache_path: Optional[str] = None
     ) -> None:
         # log input parameters
         params = locals()
@@ -27,13 +32,32 @@ class vLLMWrapperMock:
         )
         self._llm = MagicMock()
 
+    @property
+    def prefix_cache_hit_ratio(self) -> Optional[float]:
+        # the mock has no prefix cache
+        return None
+
+    @property
+    def generation_cache_stats(self) -> Optional[Dict[str, int]]:
+        # the mock responses are not cached
+        return None
+
+    def reset_stats(self) -> None:
+        # the mock has no stats to reset
+        pass
+
     def generate_batch(
         self,
-        prompts: List[str],
+        prompts: Union[List[str], List[TokenizedPrompt]],
         temperature: float,
         max_tokens: int,
         top_p: float
     ) -> List[str]:
+        # tokenized prompts are answered by their text
+        prompts = [
+            prompt.text if isinstance(prompt, TokenizedPrompt) else prompt
+            for prompt in prompts
+        ]
         # simulates the generate_batch method response with MagicMock
         mocked_results = [
             MagicMock(
@@ -49,9 +73,21 @@ class vLLMWrapperMock:
         )
         return [res.outputs[0].text for res in results]
 
+    def generate_stream(
+        self,
+        prompts: Union[List[str], List[TokenizedPrompt]],
+        temperature: float,
+        max_tokens: int,
+        top_p: float
+    ) -> Iterator[Tuple[int, str]]:
+        # simulates responses that finish out of order - shortest first
+        responses = self.generate_batch(prompts, temperature, max_tokens, top_p)
+        order = sorted(range(len(responses)), key=lambda idx: len(responses[idx]))
+        return iter([(idx, responses[idx]) for idx in order])
+
     def generate(
         self,
-        prompt: str,
+        prompt: Union[str, TokenizedPrompt],
         temperature: float,
         max_tokens: int,
         top_p: float
@@ -1,14 +1,17 @@
 from common.entities import PromptingMode
 from tests.conftest import download_nq_files_if_needed
 import common.nq_data as nq_data
+import common.nq_shuffle as nq_shuffle
 import common.consts as common_consts
 import tests.consts as test_consts
 
 from typing import Callable, Dict, Any
+from pathlib import Path
 import logging
 import shutil
 import pytest
 import json
+import re
 import os
 
 
@@ -75,6 +78,33 @@ def test_download_files_by_num_docs() -> None:
         assert res_file == src_file
 
 
+def test_parallel_files_downloading(tmp_path: Path) -> None:
+
+    created_folder = nq_data.download_files_by_num_docs(
+        src_dir=common_consts.DATA_SRC_DIR,
+        dst_dir=str(tmp_path),
+        num_docs=common_consts.SUPPORTED_NUM_DOCS[0],
+        num_workers=test_consts.NUM_WORKERS_TO_TEST
+    )
+    assert sorted(os.listdir(created_folder)) == \
+        test_consts.DOCUMETS_FOLDER_FILES
+    assert nq_data.verify_folder_files(created_folder) == []
+
+    # a truncated file is reported and extracted again on the next download
+    corrupted_file = test_consts.DOCUMETS_FOLDER_FILES[0]
+    with open(os.path.join(created_folder, corrupted_file), "r+b") as f:
+        f.truncate(1)
+    assert nq_data.verify_folder_files(created_folder) == [corrupted_file]
+
+    nq_data.download_files_by_num_docs(
+        src_dir=common_consts.DATA_SRC_DIR,
+        dst_dir=str(tmp_path),
+        num_docs=common_consts.SUPPORTED_NUM_DOCS[0],
+        num_workers=test_consts.NUM_WORKERS_TO_TEST
+    )
+    assert nq_data.verify_folder_files(created_folder) == []
+
+
 @pytest.mark.parametrize(
     "test_results",
     ["./tests/results/data_handling.yaml"],
@@ -101,7 +131,10 @@ def test_skipping_files_downloading(
             gold_idx=common_consts.SUPPORTED_GOLD_IDXS[-1] #29
         )
 
-        assert caplog.text.strip() == test_results["expected_log_msg"]
+        # the messages are compared without their line numbers, so edits
+        # to nq_data.py don't break the test
+        log_msg = re.sub(r"(nq_data\.py):\d+", r"\1", caplog.text.strip())
+        assert log_msg == test_results["expected_log_msg"]
 
 
 @pytest.mark.parametrize(
@@ -190,6 +223,218 @@ def test_openbook_random_documents_list_creation(
         test_results["openbook_random_docs"][0]["original_retrieval_index"]
 
 
+def test_seeded_openbook_random_documents_order() -> None:
+
+    download_nq_files_if_needed()
+    seed = 0
+    _, _, documents = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK
+    )
+    _, _, random_documents = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK_RANDOM,
+        seed=seed
+    )
+    for example_documents, example_random_documents in zip(
+        documents, random_documents
+    ):
+        assert sorted(example_random_documents, key=repr) == \
+            sorted(example_documents, key=repr)
+        gold_idx = [doc.isgold for doc in example_documents].index(True)
+        assert example_random_documents[gold_idx] == example_documents[gold_idx]
+
+    # the order depends only on the seed and the example line index
+    line_indices = test_consts.LINE_INDICES_TO_TEST
+    _, _, examples_documents = nq_data.read_examples(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK_RANDOM,
+        line_indices=line_indices,
+        seed=seed
+    )
+    assert examples_documents == [random_documents[idx] for idx in line_indices]
+
+    # loaded data keeps the file order and the permutations apart
+    data = nq_data.read_files_by_num_docs(
+        folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+        prompting_mode=PromptingMode.OPENBOOK_RANDOM,
+        num_workers=test_consts.NUM_WORKERS_TO_TEST,
+        seed=seed
+    )
+    entry = data[f"gold_at_{common_consts.SUPPORTED_GOLD_IDXS[0]}"]
+    assert entry["documents"] == documents
+    assert [
+        nq_shuffle.apply(example_documents, permutation)
+        for example_documents, permutation in zip(
+            entry["documents"], entry["permutations"]
+        )
+    ] == random_documents
+
+
+def test_streamed_documents_list_creation() -> None:
+
+    download_nq_files_if_needed()
+    questions, answers, documents = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK
+    )
+    examples = nq_data.iter_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK
+    )
+
+    num_examples = 0
+    for i, (question, example_answers, example_documents) in enumerate(examples):
+        assert question == questions[i]
+        assert example_answers == answers[i]
+        assert example_documents == documents[i]
+        num_examples += 1
+    assert num_examples == len(questions)
+
+    data = nq_data.read_files_by_num_docs(
+        folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+        prompting_mode=PromptingMode.OPENBOOK,
+        stream=True
+    )
+    for entry in data.values():
+        assert list(entry.keys()) == ["stream"]
+        question, _, _, _ = next(entry["stream"]())
+        assert question == questions[0]
+
+
+def test_random_access_documents_list_creation() -> None:
+
+    download_nq_files_if_needed()
+    file_content = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK
+    )
+
+    start, stop = test_consts.LINE_RANGE_TO_TEST
+    range_content = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK,
+        start=start,
+        stop=stop
+    )
+    assert range_content == tuple(values[start:stop] for values in file_content)
+
+    line_indices = test_consts.LINE_INDICES_TO_TEST
+    examples_content = nq_data.read_examples(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK,
+        line_indices=line_indices
+    )
+    assert examples_content == tuple(
+        [values[idx] for idx in line_indices] for values in file_content
+    )
+
+
+def test_parallel_data_dict_creation() -> None:
+
+    download_nq_files_if_needed()
+    for prompting_mode in [PromptingMode.OPENBOOK, PromptingMode.CLOSEDBOOK]:
+        data = nq_data.read_files_by_num_docs(
+            folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+            prompting_mode=prompting_mode
+        )
+        parallel_data = nq_data.read_files_by_num_docs(
+            folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+            prompting_mode=prompting_mode,
+            num_workers=test_consts.NUM_WORKERS_TO_TEST
+        )
+        assert parallel_data == data
+
+
+def test_head_data_dict_creation() -> None:
+
+    download_nq_files_if_needed()
+    n = test_consts.NUM_DOCS_TO_TEST
+    data = nq_data.read_files_by_num_docs(
+        folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+        prompting_mode=PromptingMode.OPENBOOK
+    )
+    for num_workers in [None, test_consts.NUM_WORKERS_TO_TEST]:
+        head_data = nq_data.read_files_by_num_docs(
+            folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+            prompting_mode=PromptingMode.OPENBOOK,
+            num_workers=num_workers,
+            max_examples=n
+        )
+        assert head_data == {
+            key: {name: values[:n] for name, values in entry.items()}
+            for key, entry in data.items()
+        }
+
+    streamed_data = nq_data.read_files_by_num_docs(
+        folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+        prompting_mode=PromptingMode.OPENBOOK,
+        stream=True,
+        max_examples=n
+    )
+    for key, entry in streamed_data.items():
+        questions = [question for question, _, _, _ in entry["stream"]()]
+        assert questions == data[key]["questions"][:n]
+
+
+def test_compressed_data_dict_creation() -> None:
+
+    download_nq_files_if_needed()
+    data = nq_data.read_files_by_num_docs(
+        folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+        prompting_mode=PromptingMode.OPENBOOK
+    )
+    compressed_data = nq_data.read_files_by_num_docs(
+        folder_path=nq_data.get_src_folder_by_num_docs(
+            src_dir=common_consts.DATA_SRC_DIR,
+            num_docs=common_consts.SUPPORTED_NUM_DOCS[0]
+        ),
+        prompting_mode=PromptingMode.OPENBOOK
+    )
+    assert compressed_data == data
+
+
+def test_validated_documents_list_creation() -> None:
+
+    download_nq_files_if_needed()
+    _, _, documents = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK
+    )
+    _, _, validated_documents = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=PromptingMode.OPENBOOK,
+        validate_documents=True
+    )
+
+    assert documents == validated_documents
+    assert nq_data.serialize(documents) == nq_data.serialize(validated_documents)
+
+
+def test_cached_documents_list_creation(tmp_path: Path) -> None:
+
+    download_nq_files_if_needed()
+    seed = 0
+    for prompting_mode in PromptingMode:
+        file_content = nq_data.read_file(
+            file_path=test_consts.TEST_DOCUMENT_PATH,
+            prompting_mode=prompting_mode,
+            seed=seed
+        )
+        # first read parses and caches the file, second loads it from cache
+        for _ in range(2):
+            cached_file_content = nq_data.read_file(
+                file_path=test_consts.TEST_DOCUMENT_PATH,
+                prompting_mode=prompting_mode,
+                seed=seed,
+                cache_dir=str(tmp_path)
+            )
+            assert cached_file_content == file_content
+
+    # openbook_random shares the openbook entry
+    assert len(os.listdir(tmp_path)) == len(PromptingMode) - 1
+
+
 @pytest.mark.parametrize(
     "test_results",
     ["./tests/results/data_handling.yaml"],
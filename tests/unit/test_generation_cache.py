@@ -0,0 +1,80 @@
+from src.generation_cache import GenerationCache
+from common.entities import TokenizedPrompt
+import common.consts as common_consts
+
+from typing import List
+from pathlib import Path
+
+
+_SAMPLING_PARAMS = {
+    "temperature": common_consts.DEFAULT_TEMPERATURE,
+    "max_tokens": common_consts.DEFAULT_MAX_TOKENS,
+    "top_p": common_consts.DEFAULT_TOP_P
+}
+
+
+def test_generation_cache(tmp_path: Path) -> None:
+    cache_path = f"{tmp_path}/completions.sqlite"
+    cache = _get_cache(cache_path)
+    generated = []
+
+    def generate_batch(prompts: List[str]) -> List[str]:
+        generated.extend(prompts)
+        return [f"answer to {prompt}" for prompt in prompts]
+
+    prompts = ["question 1", "question 2"]
+    assert cache.generate(prompts, _SAMPLING_PARAMS, generate_batch) == \
+        ["answer to question 1", "answer to question 2"]
+    # only the prompts that are not cached yet are generated, and tokenized
+    # prompts share the completions of their text
+    prompts = [
+        TokenizedPrompt(text="question 1", token_ids=[1, 2], num_tokens=2),
+        "question 3"
+    ]
+    assert cache.generate(prompts, _SAMPLING_PARAMS, generate_batch) == \
+        ["answer to question 1", "answer to question 3"]
+    assert generated == ["question 1", "question 2", "question 3"]
+    assert cache.stats == {"hits": 1, "misses": 3}
+
+    # the sampling params and the model are part of the key
+    other_sampling_params = {**_SAMPLING_PARAMS, "temperature": 0.0}
+    assert cache.get_many(["question 1"], other_sampling_params) == [None]
+    cache.close()
+    cache = _get_cache(cache_path, model=common_consts.DEFAULT_MODEL + "-2")
+    assert cache.get_many(["question 1"], _SAMPLING_PARAMS) == [None]
+    cache.close()
+
+    # the completions are persisted across instances, until they expire
+    cache = _get_cache(cache_path)
+    assert cache.get_many(["question 1"], _SAMPLING_PARAMS) == \
+        ["answer to question 1"]
+    cache.close()
+    cache = _get_cache(cache_path, max_age_days=0)
+    assert cache.get_many(["question 1"], _SAMPLING_PARAMS) == [None]
+    cache.close()
+
+    # the least recently used completions are evicted beyond max_entries
+    cache = _get_cache(cache_path, max_entries=2)
+    cache.put_many(["question 1", "question 2"], ["1", "2"], _SAMPLING_PARAMS)
+    cache.get_many(["question 1"], _SAMPLING_PARAMS)
+    cache.put_many(["question 3"], ["3"], _SAMPLING_PARAMS)
+    assert cache.get_many(
+        ["question 1", "question 2", "question 3"], _SAMPLING_PARAMS
+    ) == ["1", None, "3"]
+    cache.close()
+
+
+def _get_cache(
+    cache_path: str,
+    model: str = common_consts.DEFAULT_MODEL,
+    max_entries: int = 10,
+    max_age_days: float = 1
+) -> GenerationCache:
+
+    return GenerationCache(
+        cache_path=cache_path,
+        model=model,
+        dtype=common_consts.SUPPORTED_DTYPES[0],
+        max_entries=max_entries,
+        max_age_days=max_age_days
+    )
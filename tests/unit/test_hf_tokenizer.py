@@ -4,6 +4,7 @@ import common.consts as common_consts
 import tests.consts as test_consts
 
 from typing import Dict, Any
+from pathlib import Path
 import pytest
 
 
@@ -92,3 +93,61 @@ def test_count_tokens(
     num_tokens = hf_tokenizer.count_tokens(prompt=prompt)
     tokenized_messages_reference = test_results["tokenized_messages_reference"]
     assert num_tokens == len(tokenized_messages_reference)
+
+
+@pytest.mark.parametrize(
+    "test_results",
+    ["./tests/results/hf_tokenizer.yaml"],
+    indirect=True
+)
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_count_tokens_batch(
+    hf_tokenizer: HfTokenizer,
+    test_results: Dict[str, Any]
+) -> None:
+
+    prompts = [test_results["prompt"], "who wrote the test prompt?"]
+    for prompt_with_inst_tokens in [False, True]:
+        num_tokens_list = hf_tokenizer.count_tokens_batch(
+            prompts, prompt_with_inst_tokens=prompt_with_inst_tokens
+        )
+        assert num_tokens_list == [
+            hf_tokenizer.count_tokens(
+                prompt=prompt, prompt_with_inst_tokens=prompt_with_inst_tokens
+            )
+            for prompt in prompts
+        ]
+
+
+@pytest.mark.parametrize(
+    "test_results",
+    ["./tests/results/hf_tokenizer.yaml"],
+    indirect=True
+)
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_cached_encode_batch(
+    hf_tokenizer: HfTokenizer,
+    test_results: Dict[str, Any],
+    tmp_path: Path
+) -> None:
+
+    texts = [test_results["prompt"], "who wrote the test prompt?"]
+    cached_tokenizer = HfTokenizer(
+        model=hf_tokenizer.model,
+        token_count_cache_path=f"{tmp_path}/token_counts.sqlite"
+    )
+    for add_special_tokens in [True, False]:
+        token_ids_list = hf_tokenizer.encode_batch(texts, add_special_tokens)
+        # the first call encodes the texts, the second reads the cache
+        for _ in range(2):
+            assert cached_tokenizer.encode_batch(
+                texts, add_special_tokens
+            ) == token_ids_list
@@ -0,0 +1,36 @@
+import common.json_codec as json_codec
+
+import pytest
+import json
+
+
+_TEST_OBJ = {
+    "model": "tiiuae/Falcon3-Mamba-7B-Instruct",
+    "experiments": {
+        "gold_at_0": {
+            "model_answers": ["Wilhelm Conrad Röntgen"],
+            "scores": [1.0],
+            "metric": "best_subspan_em",
+            "num_prompt_tokens": [1446]
+        }
+    }
+}
+
+
+@pytest.mark.parametrize("backend", json_codec.get_backends())
+def test_loads(backend: str) -> None:
+    encoded = json.dumps(_TEST_OBJ)
+    assert json_codec.loads(encoded, backend=backend) == _TEST_OBJ
+    assert json_codec.loads(encoded.encode("utf-8"), backend=backend) == _TEST_OBJ
+
+
+@pytest.mark.parametrize("backend", json_codec.get_backends())
+def test_dumps(backend: str) -> None:
+    encoded = json_codec.dumps(_TEST_OBJ, indent=2, backend=backend)
+    assert json.loads(encoded) == _TEST_OBJ
+
+
+def test_fields_decoder() -> None:
+    decode = json_codec.get_fields_decoder(["model", "missing"])
+    encoded = json.dumps(_TEST_OBJ).encode("utf-8")
+    assert decode(encoded) == {"model": _TEST_OBJ["model"], "missing": None}
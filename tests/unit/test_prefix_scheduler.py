@@ -0,0 +1,33 @@
+from common.entities import TokenizedPrompt
+import src.prefix_scheduler as prefix_scheduler
+
+from typing import List
+
+
+def test_prefix_order() -> None:
+    prompts = [
+        _get_prompt([1, 2, 3, 4]),
+        _get_prompt([5, 6]),
+        _get_prompt([1, 2, 7]),
+        _get_prompt([5, 6, 8]),
+        _get_prompt([1, 2, 3, 9])
+    ]
+
+    order = prefix_scheduler.get_prefix_order(prompts)
+    ordered_prompts = [prompts[idx] for idx in order]
+    # prompts that share a prefix are submitted next to each other
+    assert [prompt.token_ids for prompt in ordered_prompts] == [
+        [1, 2, 3, 4], [1, 2, 3, 9], [1, 2, 7], [5, 6], [5, 6, 8]
+    ]
+
+    # 3 + 2 + 0 + 2 shared tokens out of 16
+    assert prefix_scheduler.get_shared_prefix_ratio(ordered_prompts) == 7 / 16
+    assert prefix_scheduler.get_shared_prefix_ratio(prompts) < 7 / 16
+
+
+def _get_prompt(token_ids: List[int]) -> TokenizedPrompt:
+    return TokenizedPrompt(
+        text=" ".join(map(str, token_ids)),
+        token_ids=token_ids,
+        num_tokens=len(token_ids)
+    )
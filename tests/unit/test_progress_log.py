@@ -0,0 +1,52 @@
+from common.progress_log import ProgressLog, get_progress_log_path
+
+from pathlib import Path
+import pytest
+import os
+
+
+def test_progress_log_resume(tmp_path: Path) -> None:
+    config = {"model": "tiiuae/Falcon3-Mamba-7B-Instruct", "num_docs": 10}
+    log_path = get_progress_log_path(str(tmp_path), config)
+    assert log_path == get_progress_log_path(str(tmp_path), dict(config))
+    assert log_path != get_progress_log_path(
+        str(tmp_path), {**config, "num_docs": 20}
+    )
+
+    progress_log = ProgressLog(log_path, header={"seed": 1})
+    progress_log.append("gold_at_0", "best_subspan_em", {"scores": [1.0, 0.0]})
+    progress_log.append("gold_at_4", "best_subspan_em", {"scores": [1.0]})
+    # a concurrent run with the same config can't use the log
+    with pytest.raises(RuntimeError):
+        ProgressLog(log_path)
+    progress_log.close()
+    # a crash while a window is logged leaves an incomplete line
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write('{"key": "gold_at_4", "metric": "best_sub')
+
+    # the resumed run keeps the header of the run it resumes
+    progress_log = ProgressLog(log_path, resume=True, header={"seed": 2})
+    assert progress_log.header == {"seed": 1}
+    assert progress_log.logged == {
+        "gold_at_0": [("best_subspan_em", {"scores": [1.0, 0.0]})],
+        "gold_at_4": [("best_subspan_em", {"scores": [1.0]})]
+    }
+    progress_log.append("gold_at_4", "best_subspan_em", {"scores": [0.0]})
+    progress_log.close()
+    progress_log = ProgressLog(log_path, resume=True)
+    assert progress_log.logged["gold_at_4"] == [
+        ("best_subspan_em", {"scores": [1.0]}),
+        ("best_subspan_em", {"scores": [0.0]})
+    ]
+    progress_log.close()
+
+    # a new (not resumed) run starts a new log
+    progress_log = ProgressLog(log_path, header={"seed": 2})
+    assert progress_log.logged == {}
+    assert progress_log.header == {"seed": 2}
+    progress_log.close()
+    progress_log = ProgressLog(log_path, resume=True)
+    assert progress_log.logged == {}
+    assert progress_log.header == {"seed": 2}
+    progress_log.remove()
+    assert not os.path.exists(log_path)
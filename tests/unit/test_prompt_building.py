@@ -1,5 +1,6 @@
+from src.token_length_index import TokenLengthIndex
 from src.prompt_builder import PromptBuilder
-from common.entities import PromptingMode, Document
+from common.entities import PromptingMode, Document, DocumentTable
 from tests.conftest import download_nq_files_if_needed
 from src.wrappers import HfTokenizer
 import common.nq_data as nq_data
@@ -7,6 +8,7 @@ import common.consts as common_consts
 import tests.consts as test_consts
 
 from typing import List, Tuple, Dict, Any
+from pathlib import Path
 import logging
 import pytest
 
@@ -123,6 +125,239 @@ def test_closedbook_prompt_builder(
     assert prompt.strip() == test_results["closedbook"]
 
 
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_interned_documents_prompt_builder(hf_tokenizer: HfTokenizer) -> None:
+
+    download_nq_files_if_needed()
+    prompting_mode = PromptingMode.OPENBOOK
+    questions, _, documents_lists = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=prompting_mode
+    )
+
+    builder = PromptBuilder(
+        prompting_mode=prompting_mode, tokenizer=hf_tokenizer
+    )
+    document_table = DocumentTable()
+    for question, documents in zip(questions[:2], documents_lists[:2]):
+        prompt = builder.build(
+            question=question,
+            documents=document_table.intern(documents),
+            document_table=document_table
+        )
+        assert prompt == builder.build(question=question, documents=documents)
+
+
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_permuted_documents_prompt_builder(hf_tokenizer: HfTokenizer) -> None:
+
+    download_nq_files_if_needed()
+    prompting_mode = PromptingMode.OPENBOOK_RANDOM
+    data = nq_data.read_files_by_num_docs(
+        folder_path=test_consts.DOCUMENTS_FOLDER_PATH,
+        prompting_mode=prompting_mode,
+        seed=0
+    )
+    _, _, documents_lists = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=prompting_mode,
+        seed=0
+    )
+
+    builder = PromptBuilder(
+        prompting_mode=prompting_mode, tokenizer=hf_tokenizer
+    )
+    entry = data[f"gold_at_{common_consts.SUPPORTED_GOLD_IDXS[0]}"]
+    for i in range(2):
+        prompt = builder.build(
+            question=entry["questions"][i],
+            documents=entry["documents"][i],
+            permutation=entry["permutations"][i]
+        )
+        assert prompt == builder.build(
+            question=entry["questions"][i], documents=documents_lists[i]
+        )
+
+
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_batch_prompt_builder(hf_tokenizer: HfTokenizer) -> None:
+
+    download_nq_files_if_needed()
+    for prompting_mode in PromptingMode:
+        questions, _, documents_lists = nq_data.read_file(
+            file_path=test_consts.TEST_DOCUMENT_PATH,
+            prompting_mode=prompting_mode,
+            seed=0
+        )
+
+        builder = PromptBuilder(
+            prompting_mode=prompting_mode, tokenizer=hf_tokenizer
+        )
+        if prompting_mode is PromptingMode.CLOSEDBOOK:
+            documents_lists = [None] * len(questions)
+        n = test_consts.NUM_DOCS_TO_TEST
+        assert builder.build_many(questions[:n], documents_lists[:n]) == [
+            builder.build(question, documents)
+            for question, documents in zip(questions[:n], documents_lists[:n])
+        ]
+
+
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_spliced_chat_template_prompt_builder(hf_tokenizer: HfTokenizer) -> None:
+
+    download_nq_files_if_needed()
+    prompting_mode = PromptingMode.OPENBOOK
+    questions, _, documents_lists = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=prompting_mode
+    )
+
+    builder = PromptBuilder(
+        prompting_mode=prompting_mode, tokenizer=hf_tokenizer
+    )
+    for question, documents in zip(questions[:2], documents_lists[:2]):
+        user_prompt = builder._user_template.format(
+            search_results=builder._format_documents(documents),
+            question=question
+        )
+        # the spliced prompt must match the per prompt template render
+        assert builder.build(question, documents) == \
+            builder._render_chat_template(user_prompt)
+
+
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_tokenized_prompt_builder(hf_tokenizer: HfTokenizer) -> None:
+
+    download_nq_files_if_needed()
+    prompting_mode = PromptingMode.OPENBOOK
+    questions, _, documents_lists = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=prompting_mode
+    )
+
+    builder = PromptBuilder(
+        prompting_mode=prompting_mode, tokenizer=hf_tokenizer
+    )
+    n = test_consts.NUM_DOCS_TO_TEST
+    prompts = builder.build_many(questions[:n], documents_lists[:n])
+    tokenized_prompts = builder.build_many(
+        questions[:n], documents_lists[:n], tokenize=True
+    )
+
+    assert [prompt.text for prompt in tokenized_prompts] == prompts
+    for prompt in tokenized_prompts:
+        # the reported length matches the experiments results token count
+        assert prompt.num_tokens == hf_tokenizer.count_tokens(
+            prompt=prompt.text, prompt_with_inst_tokens=True
+        )
+
+
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_token_length_index(hf_tokenizer: HfTokenizer, tmp_path: Path) -> None:
+
+    download_nq_files_if_needed()
+    prompting_mode = PromptingMode.OPENBOOK
+    questions, _, documents_lists = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=prompting_mode
+    )
+
+    builder = PromptBuilder(
+        prompting_mode=prompting_mode, tokenizer=hf_tokenizer
+    )
+    n = test_consts.NUM_DOCS_TO_TEST
+    questions, documents_lists = questions[:n], documents_lists[:n]
+    prompts = builder.build_many(questions, documents_lists, tokenize=True)
+
+    index_path = f"{tmp_path}/token_lengths.npz"
+    index = TokenLengthIndex(builder, hf_tokenizer, index_path)
+    counts = index.count_tokens(questions, documents_lists)
+    num_exact, max_error = index.verify(prompts, questions, documents_lists)
+    logging.info(f"Token length index: {num_exact}/{n} exact counts")
+    # at most the tokens merged across each document boundary may differ
+    assert max_error <= len(documents_lists[0])
+
+    index.save()
+    loaded_index = TokenLengthIndex(builder, hf_tokenizer, index_path)
+    assert loaded_index.count_tokens(questions, documents_lists) == counts
+
+
+@pytest.mark.parametrize(
+    "hf_tokenizer",
+    [common_consts.DEFAULT_MODEL],
+    indirect=True
+)
+def test_token_budget_prompt_builder(hf_tokenizer: HfTokenizer) -> None:
+
+    download_nq_files_if_needed()
+    prompting_mode = PromptingMode.OPENBOOK
+    questions, _, documents_lists = nq_data.read_file(
+        file_path=test_consts.TEST_DOCUMENT_PATH,
+        prompting_mode=prompting_mode
+    )
+
+    builder = PromptBuilder(
+        prompting_mode=prompting_mode, tokenizer=hf_tokenizer
+    )
+    index = TokenLengthIndex(builder, hf_tokenizer)
+    n = test_consts.NUM_DOCS_TO_TEST
+    questions, documents_lists = questions[:n], documents_lists[:n]
+    num_tokens_list = index.count_tokens(questions, documents_lists)
+    # a budget that only the shortest prompt fits into
+    token_budget = min(num_tokens_list)
+
+    fitted_documents_lists, permutations, dropped_idxs_list = \
+        builder.fit_documents(questions, documents_lists, token_budget, index)
+
+    assert permutations is None
+    for documents, fitted_documents, dropped_idxs, num_tokens in zip(
+        documents_lists, fitted_documents_lists, dropped_idxs_list,
+        num_tokens_list
+    ):
+        assert (num_tokens > token_budget) == bool(dropped_idxs)
+        assert len(fitted_documents) == len(documents) - len(dropped_idxs)
+        assert [
+            document for idx, document in enumerate(documents)
+            if idx not in dropped_idxs
+        ] == fitted_documents
+        # the gold document is kept and the lowest score ones are dropped
+        assert all(documents[idx].isgold is not True for idx in dropped_idxs)
+        if dropped_idxs:
+            max_dropped_score = max(documents[idx].score for idx in dropped_idxs)
+            assert all(
+                document.score >= max_dropped_score
+                for document in fitted_documents if document.isgold is not True
+            )
+    assert all(
+        num_tokens <= token_budget
+        for num_tokens in index.count_tokens(questions, fitted_documents_lists)
+    )
+
+
 def _get_test_prompt_with_documents(
     hf_tokenizer: HfTokenizer,
     prompting_mode: PromptingMode,
@@ -0,0 +1,54 @@
+from common.results_spill import ResultsSpill
+import common.json_codec as json_codec
+
+from typing import Dict, Any
+from pathlib import Path
+import copy
+import os
+
+
+def test_results_spill(tmp_path: Path) -> None:
+    results = _get_empty_results()
+    expected_results = _get_empty_results()
+    windows = [
+        ("gold_at_0", ["Wilhelm Conrad Röntgen", "1901"], [1.0, 0.0], [[], [2, 6]]),
+        ("gold_at_4", ["Röntgen"], [1.0], [[3]]),
+        ("gold_at_0", ["\"quoted\"\nanswer"], [0.0], [[]])
+    ]
+
+    spill = ResultsSpill(str(tmp_path))
+    for key, model_answers, scores, dropped_documents in windows:
+        entries = {
+            "model_answers": model_answers,
+            "scores": scores,
+            "num_prompt_tokens": [len(answer) for answer in model_answers],
+            "dropped_documents": dropped_documents
+        }
+        spill.append(key, entries)
+        for name, values in entries.items():
+            expected_results["experiments"][key][name].extend(values)
+
+    # the spilled lists are filled into the (empty) results lists
+    results_path = f"{tmp_path}/results.json"
+    spill.write(results, results_path)
+    with open(results_path, encoding="utf-8") as f:
+        assert f.read() == json_codec.dumps(expected_results, indent=2) + "\n"
+    # the spill file is removed once the results are written
+    assert os.listdir(tmp_path) == ["results.json"]
+
+
+def _get_empty_results() -> Dict[str, Any]:
+    experiment = {
+        "model_answers": [],
+        "scores": [],
+        "metric": "best_subspan_em",
+        "num_prompt_tokens": [],
+        "dropped_documents": []
+    }
+    return {
+        "model": "tiiuae/Falcon3-Mamba-7B-Instruct",
+        "experiments": {
+            key: copy.deepcopy(experiment)
+            for key in ["gold_at_0", "gold_at_4", "gold_at_9"]
+        }
+    }
@@ -0,0 +1,63 @@
+from src.token_count_cache import TokenCountCache
+
+from pathlib import Path
+
+
+def test_token_count_cache(tmp_path: Path) -> None:
+    cache_path = f"{tmp_path}/token_counts.sqlite"
+    cache = TokenCountCache(cache_path, tokenizer_id="test", max_entries=10)
+    texts = [f"prompt {idx}" for idx in range(5)]
+
+    assert cache.get_many(texts, variant="prompt") == [None] * len(texts)
+    cache.put_many(texts, list(range(len(texts))), variant="prompt")
+    assert cache.get_many(texts, variant="prompt") == list(range(len(texts)))
+    # the counting variant and the tokenizer are part of the key
+    assert cache.get_many(texts, variant="messages") == [None] * len(texts)
+    cache.close()
+
+    other_cache = TokenCountCache(cache_path, tokenizer_id="other", max_entries=10)
+    assert other_cache.get_many(texts, variant="prompt") == [None] * len(texts)
+    other_cache.close()
+
+    # the counts are persisted across instances
+    cache = TokenCountCache(cache_path, tokenizer_id="test", max_entries=10)
+    assert cache.get_many(texts, variant="prompt") == list(range(len(texts)))
+    cache.close()
+
+
+def test_token_count_cache_eviction(tmp_path: Path) -> None:
+    cache = TokenCountCache(
+        f"{tmp_path}/token_counts.sqlite", tokenizer_id="test", max_entries=4
+    )
+    cache.put_many(["a", "b", "c"], [1, 2, 3], variant="prompt")
+    # reading "a" makes "b" and "c" the least recently used counts
+    assert cache.get_many(["a"], variant="prompt") == [1]
+    cache.put_many(["d", "e"], [4, 5], variant="prompt")
+
+    assert len(cache) == 4
+    assert cache.get_many(["a", "d", "e"], variant="prompt") == [1, 4, 5]
+    assert cache.get_many(["b", "c"], variant="prompt").count(None) == 1
+    cache.close()
+
+
+def test_token_ids_cache(tmp_path: Path) -> None:
+    cache_path = f"{tmp_path}/token_counts.sqlite"
+    cache = TokenCountCache(cache_path, tokenizer_id="test", max_entries=2)
+    texts = ["a b", "c", "d e f"]
+    token_ids_list = [[1, 2], [3], [4, 5, 6]]
+
+    cache.put_token_ids_many(texts[:2], token_ids_list[:2], variant="text")
+    assert cache.get_token_ids_many(texts, variant="text") == \
+        token_ids_list[:2] + [None]
+    # the token ids and the counts are cached separately
+    assert cache.get_many(texts[:2], variant="text") == [None, None]
+    cache.close()
+
+    # the token ids are persisted across instances, and the least recently
+    # used ones are evicted beyond max_entries
+    cache = TokenCountCache(cache_path, tokenizer_id="test", max_entries=2)
+    assert cache.get_token_ids_many(texts[:1], variant="text") == [[1, 2]]
+    cache.put_token_ids_many(texts[2:], token_ids_list[2:], variant="text")
+    assert cache.get_token_ids_many(texts, variant="text") == \
+        [[1, 2], None, [4, 5, 6]]
+    cache.close()
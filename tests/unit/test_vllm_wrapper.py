@@ -82,3 +82,33 @@ def test_generate_batch(
     for prompt, model_answer in zip(prompts, model_answers):
         resp = f"{resp_prefix}{prompt[:common_consts.DEFAULT_MAX_TOKENS]}..."
         assert resp == model_answer
+
+
+@pytest.mark.parametrize(
+    "test_results",
+    ["./tests/results/vllm_wrapper.yaml"],
+    indirect=True
+)
+def test_generate_stream(
+    test_results: Dict[str, Any],
+    vllm_wrapper_mock: vLLMWrapperMock
+) -> None:
+
+    prompts = test_results["batch_prompts"]
+    model_answers = vllm_wrapper_mock.generate_batch(
+        prompts=prompts,
+        top_p=common_consts.DEFAULT_TOP_P,
+        max_tokens=common_consts.DEFAULT_MAX_TOKENS,
+        temperature=common_consts.DEFAULT_TEMPERATURE
+    )
+    streamed_answers = list(vllm_wrapper_mock.generate_stream(
+        prompts=prompts,
+        top_p=common_consts.DEFAULT_TOP_P,
+        max_tokens=common_consts.DEFAULT_MAX_TOKENS,
+        temperature=common_consts.DEFAULT_TEMPERATURE
+    ))
+
+    # every prompt is answered once, in the order the answers finish
+    assert sorted(idx for idx, _ in streamed_answers) == list(range(len(prompts)))
+    for idx, model_answer in streamed_answers:
+        assert model_answer == model_answers[idx]